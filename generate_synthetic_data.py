@@ -1,88 +1,159 @@
 import pandas as pd
 import numpy as np
+import argparse
 import os
-from datetime import datetime, timedelta
-
-
-def generate():
-    print(" Generating SIGNAL-RICH synthetic data...")
-    n_views = 50_000
-    n_users = 2000
-    n_items = 500
-
-    # 1. Setup Item Popularity (Power Law)
-    # Items 0-50 are "Viral", 51-500 are "Long Tail"
-    item_ids = np.arange(n_items)
-    item_probs = 1 / (item_ids + 1)  # Zipfian distribution
-    item_probs /= item_probs.sum()
-
-    # 2. Setup User Activity Levels
-    # Users 0-200 are "Power Users"
-    user_ids = np.arange(n_users)
-    user_activity = 1 / (user_ids + 1)
-    user_activity /= user_activity.sum()
-
-    # 3. Generate Views (Biased towards popular items and active users)
-    base_time = datetime.now() - timedelta(days=30)
-
+import shutil
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from src.pipeline.ingest_retailrocket import write_partitioned
+from src.schema import EVENT_TYPES, EVENT_SCHEMA, enforce_schema
+
+# CONFIG
+CSV_OUTPUT_PATH = "data/raw/events.csv"
+PARQUET_OUTPUT_DIR = "data/raw/events"  # Same date-partitioned layout as ingest_retailrocket.py
+CHUNK_SIZE = 1_000_000  # Views generated per chunk; bounds peak memory
+
+DEFAULTS = {
+    'n_users': 2000,
+    'n_items': 500,
+    'n_views': 50_000,
+    'start': '2024-01-01',  # First day of the timeline: the same seed always yields the same events
+    'days': 30,
+    'click_rate': 0.05,     # Base P(click | view), before the item/user/weekend boosts
+    'cart_rate': 0.05,      # Base P(add-to-cart | click), before the item boost
+    'purchase_rate': 0.05,  # Base P(purchase | click), before the item boost
+    'seed': 42
+}
+
+_SEC = np.int64(1_000_000_000)
+_DAY = 24 * 3600 * _SEC
+
+
+def zipf_cdf(n):
+    """CDF of a 1/(rank+1) popularity curve: rank 0 is the most popular ID."""
+    weights = 1 / np.arange(1, n + 1, dtype=np.float64)
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def follow_up(rng, ts, user_ids, item_ids, prob, delay_range, event_type):
+    """Samples outcome events for the rows where rand < prob, delayed by a random number of seconds."""
+    hit = rng.random(len(ts)) < prob
+    delay = rng.integers(*delay_range, size=int(hit.sum())) * _SEC
+    return hit, (ts[hit] + delay, user_ids[hit], item_ids[hit], event_type)
+
+
+def generate_chunk(rng, n_views, t_lo, t_hi, user_cdf, item_cdf, config):
+    """One time slice of views [t_lo, t_hi) plus the clicks, carts and purchases they lead to."""
+    n_users, n_items = len(user_cdf), len(item_cdf)
+
+    # 1. Views (biased towards popular items and active users)
+    ts = np.sort(rng.integers(t_lo, t_hi, size=n_views))
+    user_ids = np.searchsorted(user_cdf, rng.random(n_views), side='right')
+    item_ids = np.searchsorted(item_cdf, rng.random(n_views), side='right')
+
+    # 2. Clicks based on FEATURE SIGNAL
+    # P(Click) increases if Item is Popular OR User is Power User OR Weekend
+    item_quality = 1 - item_ids / n_items
+    user_quality = 1 - user_ids / n_users
+    is_weekend = ((ts // _DAY + 3) % 7) >= 5  # 1970-01-01 was a Thursday
+    click_prob = np.clip(config['click_rate'] + 0.15 * item_quality + 0.10 * user_quality + 0.05 * is_weekend, 0, 0.8)
+    clicked, clicks = follow_up(rng, ts, user_ids, item_ids, click_prob, (30, 300), 'click')
+
+    # 3. Carts and Purchases (Strong signal: Very popular items get bought)
+    clicked_quality = item_quality[clicked]
+    _, carts = follow_up(rng, *clicks[:3], config['cart_rate'] + 0.2 * clicked_quality, (30, 300), 'addtocart')
+    _, purchases = follow_up(rng, *clicks[:3], config['purchase_rate'] + 0.2 * clicked_quality, (60, 600), 'transaction')
+
+    views = (ts, user_ids, item_ids, 'view')
+    return [views, clicks, carts, purchases]
+
+
+def to_frame(parts):
+    times, users, items, types = [], [], [], []
+    for ts, user_ids, item_ids, event_type in parts:
+        times.append(ts)
+        users.append(user_ids)
+        items.append(item_ids)
+        types.append(np.full(len(ts), EVENT_TYPES.categories.get_loc(event_type), dtype=np.int8))
+    ts = np.concatenate(times)
+    order = np.argsort(ts, kind='stable')
     df = pd.DataFrame({
-        'timestamp': [base_time + timedelta(seconds=np.random.randint(0, 30 * 24 * 3600)) for _ in range(n_views)],
-        'user_id': np.random.choice(user_ids, size=n_views, p=user_activity),
-        'item_id': np.random.choice(item_ids, size=n_views, p=item_probs),
-        'event_type': 'view'
+        'timestamp': ts[order].view('datetime64[ns]'),
+        'user_id': np.concatenate(users)[order],
+        'item_id': np.concatenate(items)[order],
+        'event_type': pd.Categorical.from_codes(np.concatenate(types)[order], dtype=EVENT_TYPES)
     })
+    return enforce_schema(df, EVENT_SCHEMA)
 
-    # 4. Generate Clicks based on FEATURE SIGNAL
-    # Formula: P(Click) increases if Item is Popular OR User is Power User OR Weekend
-
-    # Calculate "Intrinsic Quality" of the view
-    # Normalized rank (0 to 1, where 1 is most popular)
-    item_quality = 1 - (df['item_id'] / n_items)
-    user_quality = 1 - (df['user_id'] / n_users)
-
-    # Time Signal: Weekends get a boost
-    df['is_weekend'] = df['timestamp'].dt.dayofweek.isin([5, 6]).astype(int)
 
-    # Base Probability = 5%
-    # + up to 15% for popular items
-    # + up to 10% for power users
-    # + 5% flat boost for weekends
-    df['click_prob'] = 0.05 + (0.15 * item_quality) + (0.10 * user_quality) + (0.05 * df['is_weekend'])
-
-    # Clip to max 80% to add some noise
-    df['click_prob'] = df['click_prob'].clip(0, 0.8)
-
-    # Roll the dice
-    df['clicked'] = np.random.rand(len(df)) < df['click_prob']
-
-    # Create Click Events
-    clicks = df[df['clicked'] == True].copy()
-    clicks['event_type'] = 'click'
-    clicks['timestamp'] += pd.to_timedelta(np.random.randint(30, 300, size=len(clicks)), unit='s')
-
-    # 5. Generate Purchases (Strong signal: Very popular items get bought)
-    clicks['purchase_prob'] = 0.05 + (0.2 * item_quality[clicks.index])
-    clicks['purchased'] = np.random.rand(len(clicks)) < clicks['purchase_prob']
-
-    purchases = clicks[clicks['purchased'] == True].copy()
-    purchases['event_type'] = 'transaction'
-    purchases['timestamp'] += pd.to_timedelta(np.random.randint(60, 600, size=len(purchases)), unit='s')
-
-    # 6. Cleanup & Save
-    final_df = pd.concat([
-        df[['timestamp', 'user_id', 'item_id', 'event_type']],
-        clicks[['timestamp', 'user_id', 'item_id', 'event_type']],
-        purchases[['timestamp', 'user_id', 'item_id', 'event_type']]
-    ]).sort_values('timestamp')
+def generate(output_format='csv', chunk_size=CHUNK_SIZE, **config):
+    config = {**DEFAULTS, **config}
+    print(" Generating SIGNAL-RICH synthetic data...")
+    rng = np.random.default_rng(config['seed'])
+    user_cdf = zipf_cdf(config['n_users'])
+    item_cdf = zipf_cdf(config['n_items'])
+
+    # Views are generated slice by slice in time order. Outcome events that fall past the end of
+    # their slice are carried into the next one, so the output is globally sorted by timestamp.
+    start = pd.Timestamp(config['start']).value
+    end = start + config['days'] * _DAY
+    n_chunks = max(1, -(-config['n_views'] // chunk_size))
+    bounds = np.linspace(start, end, n_chunks + 1).astype(np.int64)
+    views_per_chunk = np.diff(np.linspace(0, config['n_views'], n_chunks + 1).astype(np.int64))
 
     os.makedirs('data/raw', exist_ok=True)
-    final_df.to_csv('data/raw/events.csv', index=False)
-
-    print(f" Generated {len(final_df):,} events with SIGNAL.")
-    print(f"   Views: {len(df)}")
-    print(f"   Clicks: {len(clicks)} (Derived from Popularity + User Activity)")
-    print(f"   Purchases: {len(purchases)}")
+    for path in (CSV_OUTPUT_PATH, PARQUET_OUTPUT_DIR):
+        # Replace any previous dataset (load_data() prefers the Parquet dataset over the CSV)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    counts = dict.fromkeys(EVENT_TYPES.categories, 0)
+    carry = None
+    for k in range(n_chunks):
+        parts = generate_chunk(rng, views_per_chunk[k], bounds[k], bounds[k + 1], user_cdf, item_cdf, config)
+        df = to_frame(parts)
+        if carry is not None:
+            df = pd.concat([carry, df], ignore_index=True).sort_values('timestamp', kind='stable')
+        if k < n_chunks - 1:
+            spill = df['timestamp'].to_numpy().view(np.int64) >= bounds[k + 1]
+            carry, df = df[spill], df[~spill]
+
+        if output_format == 'parquet':
+            write_partitioned(df, PARQUET_OUTPUT_DIR, k)
+        else:
+            df.to_csv(CSV_OUTPUT_PATH, mode='a', header=(k == 0), index=False)
+        for event_type, n in df['event_type'].value_counts().items():
+            counts[event_type] += int(n)
+
+    target = PARQUET_OUTPUT_DIR if output_format == 'parquet' else CSV_OUTPUT_PATH
+    print(f" Generated {sum(counts.values()):,} events with SIGNAL to {target}.")
+    print(f"   Views: {counts['view']:,}")
+    print(f"   Clicks: {counts['click']:,} (Derived from Popularity + User Activity)")
+    print(f"   Carts: {counts['addtocart']:,}")
+    print(f"   Purchases: {counts['transaction']:,}")
 
 
 if __name__ == "__main__":
-    generate()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=DEFAULTS['n_users'])
+    parser.add_argument('--items', type=int, default=DEFAULTS['n_items'])
+    parser.add_argument('--views', type=int, default=DEFAULTS['n_views'])
+    parser.add_argument('--start', default=DEFAULTS['start'], help="First day of the generated timeline (YYYY-MM-DD)")
+    parser.add_argument('--days', type=int, default=DEFAULTS['days'])
+    parser.add_argument('--click-rate', type=float, default=DEFAULTS['click_rate'])
+    parser.add_argument('--cart-rate', type=float, default=DEFAULTS['cart_rate'])
+    parser.add_argument('--purchase-rate', type=float, default=DEFAULTS['purchase_rate'])
+    parser.add_argument('--seed', type=int, default=DEFAULTS['seed'])
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv',
+                        help="parquet streams to the date-partitioned dataset (faster at scale)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    generate(
+        output_format=args.format, chunk_size=args.chunk_size,
+        n_users=args.users, n_items=args.items, n_views=args.views, start=args.start, days=args.days,
+        click_rate=args.click_rate, cart_rate=args.cart_rate, purchase_rate=args.purchase_rate, seed=args.seed
+    )
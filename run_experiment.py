@@ -1,7 +1,7 @@
 import pandas as pd
-import joblib
+import numpy as np
 from src.evaluation.metrics import calculate_qini
-import os
+from src.models.bundle import current_version, load_bundle
 
 
 def evaluate_model():
@@ -12,12 +12,11 @@ def evaluate_model():
     df = pd.read_parquet("data/features/training_set.parquet")
 
     # Load Uplift Model
-    model_path = "models/uplift/uplift_meta_learner.pkl"
-    if not os.path.exists(model_path):
+    if current_version() is None:
         print(" Model not found. Run 'make train' first.")
         return
 
-    learner = joblib.load(model_path)
+    learner = load_bundle().uplift
 
     # Prepare Features
     drop_cols = ['impression_id', 'user_id', 'item_id', 'impression_time',
@@ -27,7 +26,7 @@ def evaluate_model():
     # Predict Uplift
     print("    Scoring users...")
     X = df[features]
-    uplift_preds = learner.predict_lift(X)
+    uplift_preds = learner.predict_lift(X)[:, 0]  # Qini is binary: first treatment vs control
 
     # Calculate Qini
     # We need: Outcome (clicked), Treatment (is_treated)
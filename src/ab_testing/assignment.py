@@ -0,0 +1,70 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import bisect
+
+from src.config import EXPERIMENT_CONFIG
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+_MIX1 = 0xBF58476D1CE4E5B9
+_MIX2 = 0x94D049BB133111EB
+
+
+def variant_names(n_variants):
+    """Arm labels: 'Control', then 'Treatment' (2 arms) or 'Treatment_1' .. 'Treatment_{n-1}'."""
+    if n_variants == 2:
+        return ['Control', 'Treatment']
+    return ['Control'] + [f'Treatment_{k}' for k in range(1, n_variants)]
+
+
+def _salt_key(salt):
+    # Stable across processes (unlike hash()), so every worker and server agrees
+    return int.from_bytes(hashlib.blake2b(salt.encode(), digest_size=8).digest(), 'little')
+
+
+class VariantAssigner:
+    """
+    Deterministic experiment assignment: hashes (salt, user_id) with a splitmix64 mix into [0, 1)
+    and buckets it by cumulative traffic weight. Nothing is stored; the same user always lands in
+    the same arm, and experiments with different salts assign independently of each other.
+    The batch (numpy) and scalar (pure Python) paths compute bit-identical results.
+    """
+
+    def __init__(self, salt=None, n_variants=None, weights=None):
+        self.salt = salt or EXPERIMENT_CONFIG['experiment_salt']
+        n_variants = n_variants or EXPERIMENT_CONFIG['n_variants']
+        weights = weights or EXPERIMENT_CONFIG.get('traffic_weights') or [1.0] * n_variants
+        if len(weights) != n_variants or min(weights) < 0 or sum(weights) <= 0:
+            raise ValueError(f"Need {n_variants} non-negative traffic weights, got {weights}")
+
+        self.names = variant_names(n_variants)
+        self.key = _salt_key(self.salt)
+        cumulative = np.cumsum(weights, dtype=np.float64) / np.sum(weights, dtype=np.float64)
+        cumulative[-1] = 1.0
+        self.bounds = cumulative[:-1].tolist()  # Upper bucket bounds for every arm but the last
+
+    def buckets(self, user_ids):
+        """Arm index (0 = Control) for every user in an array."""
+        z = np.asarray(user_ids).astype(np.int64).view(np.uint64) ^ np.uint64(self.key)
+        z = z + np.uint64(_GOLDEN)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(_MIX1)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(_MIX2)
+        z = z ^ (z >> np.uint64(31))
+        u = (z >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+        return np.searchsorted(self.bounds, u, side='right').astype(np.int8)
+
+    def assign(self, user_ids):
+        """Vectorized assignment for the pipeline: a Categorical of arm names."""
+        return pd.Categorical.from_codes(self.buckets(user_ids), categories=self.names)
+
+    def bucket(self, user_id):
+        """O(1) arm index for a single user (serving path)."""
+        z = (((int(user_id) & _MASK) ^ self.key) + _GOLDEN) & _MASK
+        z = ((z ^ (z >> 30)) * _MIX1) & _MASK
+        z = ((z ^ (z >> 27)) * _MIX2) & _MASK
+        z = z ^ (z >> 31)
+        return bisect.bisect_right(self.bounds, (z >> 11) * 2.0 ** -53)
+
+    def assign_one(self, user_id):
+        return self.names[self.bucket(user_id)]
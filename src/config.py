@@ -11,12 +11,13 @@ FEATURE_DATA_PATH = DATA_DIR / "features" / "training_set.parquet"
 
 # Model Artifacts
 MODEL_DIR = PROJECT_ROOT / "models"
-RANKER_MODEL_PATH = MODEL_DIR / "ranking" / "xgb_ranker.json"
-UPLIFT_MODEL_PATH = MODEL_DIR / "uplift" / "uplift_meta_learner.pkl"
+BUNDLE_DIR = MODEL_DIR / "bundle"  # Versioned ranker + uplift bundles (see src/models/bundle.py)
 
 # Experiment Settings
 EXPERIMENT_CONFIG = {
     "n_variants": 2,
+    "experiment_salt": "ranking-uplift-v1",  # Change (or run a second salt) to re-randomize users
+    "traffic_weights": None,  # Per-variant share, Control first; None = even split
     "confidence_level": 0.95,
     "min_sample_size": 1000,
     "uplift_threshold": 0.01  # Minimum 1% lift to declare winner
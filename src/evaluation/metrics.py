@@ -1,6 +1,21 @@
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz  # Renamed in NumPy 2.0; requirements allow 1.24+
+
+
+def qini_curve(y_true, uplift_score, treatment):
+    """Cumulative incremental gains (treated conversions minus scaled control conversions), highest lift first."""
+    order = np.argsort(-np.asarray(uplift_score, dtype=np.float64), kind='stable')
+    y = np.asarray(y_true, dtype=np.float64)[order]
+    t = np.asarray(treatment, dtype=np.float64)[order]
+    n_t, n_c = t.sum(), (1 - t).sum()
+    return np.cumsum(y * t) - np.cumsum(y * (1 - t)) * n_t / max(n_c, 1)
+
+
+def qini_area(y_true, uplift_score, treatment):
+    """Area under the Qini curve over the population fraction (AUUC)."""
+    curve = qini_curve(y_true, uplift_score, treatment)
+    return float(_trapezoid(curve, dx=1 / len(curve))) if len(curve) else 0.0
 
 
 def calculate_qini(y_true, uplift_score, treatment, plot=False):
@@ -12,40 +27,17 @@ def calculate_qini(y_true, uplift_score, treatment, plot=False):
         uplift_score: Predicted lift (treatment effect)
         treatment: Binary treatment indicator (0=Control, 1=Treatment)
     """
-    # Create a dataframe for sorting
-    data = pd.DataFrame({
-        'y': y_true,
-        'uplift': uplift_score,
-        't': treatment
-    }).sort_values('uplift', ascending=False)
-
-    # Cumulative stats
-    data['n_t'] = data['t'].cumsum()  # Count of treated users
-    data['n_c'] = (1 - data['t']).cumsum()  # Count of control users
-    data['y_t'] = (data['y'] * data['t']).cumsum()  # Count of treated conversions
-    data['y_c'] = (data['y'] * (1 - data['t'])).cumsum()  # Count of control conversions
-
-    # Prevent division by zero
-    data['n_t'] = data['n_t'].replace(0, 1)
-    data['n_c'] = data['n_c'].replace(0, 1)
-
-    # Calculate incremental gains (Qini Curve)
-    # Gain = (Conversions/Treated) - (Conversions/Control) scaled by total population
-    N_t_total = data['t'].sum()
-    N_c_total = (1 - data['t']).sum()
-
-    # Standardized Qini Curve calculation
-    data['curve'] = data['y_t'] - (data['y_c'] * N_t_total / N_c_total)
-
-    # Area Under Curve (Approximate)
-    area = np.trapz(data['curve'], dx=1 / len(data))
+    curve = qini_curve(y_true, uplift_score, treatment)
+    area = float(_trapezoid(curve, dx=1 / len(curve)))  # Area Under Curve (Approximate)
 
     print(f"    Qini Score (AUUC): {area:.4f}")
 
     if plot:
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(10, 6))
-        plt.plot(range(len(data)), data['curve'], label='Model')
-        plt.plot([0, len(data)], [0, data['curve'].iloc[-1]], 'r--', label='Random')
+        plt.plot(range(len(curve)), curve, label='Model')
+        plt.plot([0, len(curve)], [0, curve[-1]], 'r--', label='Random')
         plt.title(f"Qini Curve (Area={area:.3f})")
         plt.xlabel("Population Targeted (Highest Lift First)")
         plt.ylabel("Cumulative Incremental Gains")
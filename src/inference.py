@@ -1,63 +1,289 @@
 import pandas as pd
-import xgboost as xgb
-import joblib
 import os
 import numpy as np
+import sys
 
-# CONFIG
-RANKER_MODEL_PATH = "models/ranking/xgb_ranker.json"
-UPLIFT_MODEL_PATH = "models/uplift/uplift_meta_learner.pkl"
-FEATURE_DATA_PATH = "data/features/training_set.parquet"  # In prod, this would be a live feature store
-
-
-# --- CRITICAL FIX: Define the Class for Pickle ---
-# We must redefine this class exactly as it was during training
-# so joblib knows how to reconstruct the saved object.
-class TLearnerUplift:
-    """
-    Simple T-Learner implementation using two XGBoost models.
-    """
-
-    def __init__(self):
-        self.m0 = xgb.XGBClassifier(objective='binary:logistic', n_estimators=50, max_depth=3)
-        self.m1 = xgb.XGBClassifier(objective='binary:logistic', n_estimators=50, max_depth=3)
-
-    def fit(self, X, y, t):
-        self.m0.fit(X[t == 0], y[t == 0])
-        self.m1.fit(X[t == 1], y[t == 1])
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from src.models.bundle import load_bundle
+from src.models.compiled import CompiledForest
+from src.models.sampling import calibrate
+from src.pipeline.feature_engineering import STATE_DIR, STATE_PATH, load_counter_stores, counter_features
+from src.pipeline.feature_store import (
+    CONTEXT_FEATURES, ITEM_WINDOW_FEATURES, RECENCY_FEATURES, FeatureStore, current_snapshot
+)
+from src.pipeline.incremental import load_state
+from src.ab_testing.assignment import VariantAssigner
+from src.schema import FEATURE_SCHEMA, enforce_schema, feature_columns
 
-    def predict_lift(self, X):
-        # Predict Prob(Conversion | Control)
-        p0 = self.m0.predict_proba(X)[:, 1]
-        # Predict Prob(Conversion | Treatment)
-        p1 = self.m1.predict_proba(X)[:, 1]
-        # Uplift = P(Treatment) - P(Control)
-        return p1 - p0
+# CONFIG
+COMPILED_PREDICT = True  # Score ranker + uplift boosters in one NumPy pass over flat tree tables
+COMPILED_MAX_ROWS = 256  # Above this batch size XGBoost's own predict is faster again
+FEATURE_DATA_PATH = "data/features/training_set.parquet"  # Rows the demo below simulates requests from
+LIFT_WEIGHT = 0.7  # Final score = LIFT_WEIGHT * lift + (1 - LIFT_WEIGHT) * CTR
+SCORE_COLS = ['predicted_ctr', 'predicted_uplift', 'final_score']  # Rows of score_matrix()'s output
 
 
 class RecommendationServingEngine:
     def __init__(self):
+        self.bundle = None
         self.ranker = None
         self.uplift_model = None
+        self.compiled = None
+        self.ctr_negative_rate = 1.0
+        self.counters = None
+        self.store = None  # Latest user/item feature vectors (see pipeline/feature_store.py)
+        self.store_cols = {}  # entity -> (model input positions, store columns)
+        self.context_cols = []  # (model input position, context feature)
+        self.recency_cols = []  # (model input position, column of FeatureStore.recency())
+        self.item_window_cols = []  # (model input position, column of FeatureStore.item_windows())
+        self.feature_version = None  # Feature snapshot in use (part of score cache keys)
+        self.item_ids = None  # Candidate block for recommend(), built by load_candidates()
+        self.item_block = None
+        self.features = None  # Model input columns, in the manifest's order
+        self.feature_index = {}
+        self.buffers = {}  # Reused input/output arrays (scoring calls run one at a time)
+        self.assigner = VariantAssigner()
         self.load_models()
+        self.load_counters()
+        self.load_store()
 
     def load_models(self):
         print(" Loading Production Models...")
 
-        # Load Ranker
-        if os.path.exists(RANKER_MODEL_PATH):
-            self.ranker = xgb.Booster()
-            self.ranker.load_model(RANKER_MODEL_PATH)
-            print("    Ranker loaded.")
-        else:
-            raise FileNotFoundError(f"Ranker model not found at {RANKER_MODEL_PATH}")
+        # Ranker + uplift learner from one bundle version (native boosters, no pickle)
+        self.bundle = load_bundle()
+        self.ranker = self.bundle.ranker
+        self.uplift_model = self.bundle.uplift
+        if self.ranker is None or self.uplift_model is None:
+            raise FileNotFoundError(f"Bundle {self.bundle.version} is missing the ranker or the uplift model.")
+        print(f"    Bundle {self.bundle.version} loaded.")
+        # One feature matrix feeds every booster, so both components must agree on its columns
+        self.features = self.bundle.features('ranker')
+        self.feature_index = {c: i for i, c in enumerate(self.features)}
+        if self.bundle.features('uplift') != self.features:
+            raise ValueError(f"Bundle {self.bundle.version}: ranker and uplift model were trained on different features.")
+        # Ranker trained on downsampled negatives: its probabilities are corrected at predict time
+        # (the uplift learner carries its own per-arm rates)
+        self.ctr_negative_rate = self.bundle.metadata('ranker').get('negative_rate', 1.0)
+        if COMPILED_PREDICT:
+            self.compile_models()
+
+    def compile_models(self):
+        """Flattens the ranker and the uplift learner's boosters into one CompiledForest."""
+        boosters = self.uplift_model.scoring_boosters()
+        if boosters is None:
+            print(f"    {type(self.uplift_model).__name__} cannot share the feature matrix; using XGBoost predict.")
+            return
+        self.compiled = CompiledForest({'ranker': self.ranker, **boosters})
+        print(f"    Compiled {len(self.compiled.roots)} trees (max depth {self.compiled.max_depth}).")
+
+    def load_counters(self):
+        # Read-only memory maps of the counter stores advanced by the feature step
+        if os.path.isdir(STATE_DIR):
+            self.counters = load_counter_stores(mmap_mode='r')
+            state = load_state(STATE_PATH)
+            self.feature_version = state['watermark'].isoformat() if state else None
+            print(f"    Counter state loaded (features through {self.feature_version}).")
+
+    def load_store(self):
+        # Read-only memory maps of the current feature store snapshot
+        if current_snapshot() is None:
+            print("    No feature store snapshot; requests must carry their own features.")
+            return
+        self.store = FeatureStore()
+        self._map_store()
+        print(f"    Feature store snapshot {self.store.version} mapped.")
+
+    def _map_store(self):
+        # Which model inputs each store entity provides, and which come from the request time
+        store_cols = {}
+        for entity in ('user', 'item'):
+            cols = [c for c in self.store.columns(entity) if c in self.feature_index]
+            store_cols[entity] = ([self.feature_index[c] for c in cols], cols)
+        self.store_cols = store_cols
+        self.context_cols = [(self.feature_index[c], c) for c in CONTEXT_FEATURES if c in self.feature_index]
+        self.recency_cols = [(self.feature_index[c], j) for j, c in enumerate(RECENCY_FEATURES) if c in self.feature_index]
+        self.item_window_cols = [(self.feature_index[c], j) for j, c in enumerate(ITEM_WINDOW_FEATURES)
+                                 if c in self.feature_index]
+        self.feature_version = self.store.version
+
+    def refresh_features(self):
+        """
+        Switches to a newer feature store snapshot (and the counter state written with it), if the
+        feature step published one. The candidate block is rebuilt on the next recommend().
+        """
+        if self.store is None or not self.store.refresh():
+            return False
+        self.load_counters()
+        self._map_store()
+        self.item_ids = self.item_block = None
+        print(f"    Switched to feature store snapshot {self.store.version}.")
+        return True
+
+    def current_counters(self, user_ids, item_ids):
+        """Cumulative user/item counters as of the latest feature run (same definition as training)."""
+        return counter_features(user_ids, item_ids, self.counters)
+
+    @staticmethod
+    def request_time(now=None):
+        """A request time (default: now) as naive UTC, like the event timestamps the features are built from."""
+        if now is None:
+            return pd.Timestamp.now(tz='UTC').tz_localize(None)
+        now = pd.Timestamp(now)
+        return now if now.tz is None else now.tz_convert('UTC').tz_localize(None)
+
+    @staticmethod
+    def request_context(now):
+        """Context features of a request time (same definitions as feature_engineering.add_row_features)."""
+        return {'hour_of_day': now.hour, 'hour': now.hour, 'day_of_week': now.dayofweek,
+                'is_weekend': int(now.dayofweek >= 5)}
+
+    def fill_features(self, A, user_ids, item_ids, now=None):
+        """
+        Completes a model input matrix in place, NumPy only: missing (NaN) user and item features are
+        gathered from the feature store by ID, missing context, user recency and windowed item features
+        are derived from the request time, and the counters are taken from the live state store.
+        """
+        now = self.request_time(now)
+        if self.store is not None:
+            for entity, ids in (('user', user_ids), ('item', item_ids)):
+                positions, cols = self.store_cols[entity]
+                if positions:
+                    given = A[:, positions]
+                    A[:, positions] = np.where(np.isnan(given), self.store.gather(entity, ids, cols), given)
+            derived = ((self.recency_cols, self.store.recency, user_ids),
+                       (self.item_window_cols, self.store.item_windows, item_ids))
+            for cols, compute, ids in derived:
+                if cols:
+                    computed = compute(ids, now)
+                    for pos, j in cols:
+                        values = A[:, pos]
+                        missing = np.isnan(values)
+                        values[missing] = computed[missing, j]
+        context = self.request_context(now)
+        for pos, col in self.context_cols:
+            values = A[:, pos]
+            values[np.isnan(values)] = context[col]
+        if self.counters is not None:
+            for col, values in self.current_counters(user_ids, item_ids).items():
+                if col in self.feature_index:
+                    A[:, self.feature_index[col]] = values
+        return A
+
+    def load_candidates(self):
+        """
+        Precomputes recommend()'s candidate block: every item in the feature store, as a contiguous
+        float32 (n_items, n_features) block in the models' feature order with the stored item columns
+        filled in. The user, context and windowed item columns are overwritten per request.
+        """
+        if self.store is None:
+            raise FileNotFoundError(" recommend() needs a feature store snapshot. Run src/pipeline/feature_store.py first.")
+        print(" Building candidate block...")
+        positions, cols = self.store_cols['item']
+        ids = np.arange(self.store.snapshot['sizes']['item'])
+        values = self.store.gather('item', ids, cols)
+        known = ~np.isnan(values).all(axis=1)
 
-        # Load Uplift
-        if os.path.exists(UPLIFT_MODEL_PATH):
-            self.uplift_model = joblib.load(UPLIFT_MODEL_PATH)
-            print("    Uplift Model loaded.")
+        block = np.full((int(known.sum()), len(self.features)), np.nan, dtype=np.float32)
+        block[:, positions] = values[known]
+        item_ids = ids[known]
+        if self.counters is not None and 'item_global_views' in self.feature_index:
+            live = self.current_counters(np.zeros(len(item_ids), dtype=np.int64), item_ids)
+            block[:, self.feature_index['item_global_views']] = live['item_global_views']
+        self.item_ids, self.item_block = item_ids, block
+        print(f"    {len(item_ids):,} candidate items.")
+
+    def variant_for(self, user_id):
+        """Experiment arm of a user: recomputed from the hash, no assignment lookup."""
+        return self.assigner.assign_one(user_id)
+
+    def _buffer(self, name, rows, shape=()):
+        # Float32 scratch array with at least `rows` rows, grown (never shrunk) as batches get larger
+        buf = self.buffers.get(name)
+        if buf is None or len(buf) < rows:
+            buf = self.buffers[name] = np.empty((rows,) + shape, dtype=np.float32)
+        return buf[:rows]
+
+    def feature_matrix(self, df):
+        """
+        The model input for a frame of feature rows: one C-contiguous float32 buffer with the columns
+        in the manifest's order (extra columns are ignored, missing ones are an error). Every booster
+        scores this buffer in place; it is reused by the next call.
+        """
+        missing = [c for c in self.features if c not in df.columns]
+        if missing:
+            raise ValueError(f"Missing model features: {missing}")
+        A = self._buffer('features', len(df), (len(self.features),))
+        for j, col in enumerate(self.features):
+            A[:, j] = df[col].to_numpy()
+        return A
+
+    def score_matrix(self, A):
+        """
+        (3, n) SCORE_COLS for a float32 matrix in the manifest's feature order: calibrated CTR,
+        lift of the best treatment arm and the final score, written into a reused output buffer
+        (copy it to keep it past the next call).
+        """
+        if self.compiled is not None and len(A) <= COMPILED_MAX_ROWS:
+            # Ranker and every uplift booster in one pass over the flattened trees
+            scores = self.compiled.predict_dict(A)
+            ctr_scores = scores.pop('ranker')
+            lift_scores = self.uplift_model.lift_from_scores(scores)
         else:
-            raise FileNotFoundError(f"Uplift model not found at {UPLIFT_MODEL_PATH}")
+            ctr_scores = self.ranker.inplace_predict(A)
+            lift_scores = self.uplift_model.predict_lift(A)
+
+        out = self._buffer('scores', 3 * len(A)).reshape(3, len(A))
+        out[0] = calibrate(ctr_scores, self.ctr_negative_rate)
+        # Multi-arm: lift of the best treatment arm over control
+        out[1] = lift_scores.max(axis=1) if lift_scores.ndim == 2 else lift_scores
+        np.multiply(out[1], LIFT_WEIGHT, out=out[2])
+        out[2] += (1 - LIFT_WEIGHT) * out[0]
+        return out
+
+    def recommend(self, user_id, k=10, now=None):
+        """
+        Top-k items for one user out of the whole candidate block: the user's features (latest known
+        row; missing for unseen users) and the request context are broadcast into the block, every
+        item is scored in one pass, and the top k are picked with argpartition instead of a full sort.
+        """
+        if self.item_block is None:
+            self.load_candidates()
+        # Stored item columns never change; the rest are rewritten per request (one call at a time)
+        item_ids, A = self.item_ids, self.item_block
+        k = min(k, len(item_ids))
+        if k <= 0:
+            # No candidates (or nothing asked for): argpartition needs at least one item to pick
+            return pd.DataFrame({'item_id': item_ids[:0], **{col: np.empty(0, np.float32) for col in SCORE_COLS}})
+
+        # 1. User features from the feature store (recency as of the request time), with counters from the live state store
+        now = self.request_time(now)
+        positions, cols = self.store_cols['user']
+        A[:, positions] = self.store.gather('user', [user_id], cols)
+        recency = self.store.recency([user_id], now)
+        for pos, j in self.recency_cols:
+            A[:, pos] = recency[0, j]
+        if self.counters is not None:
+            live = self.current_counters(np.asarray([user_id]), item_ids[:1])
+            for col in ('user_view_count', 'user_item_log_views'):
+                if col in self.feature_index:
+                    A[:, self.feature_index[col]] = live[col][0]
+
+        # 2. Request context, and the windowed item counts as of the request time
+        context = self.request_context(now)
+        for pos, col in self.context_cols:
+            A[:, pos] = context[col]
+        if self.item_window_cols:
+            windows = self.store.item_windows(item_ids, now)
+            for pos, j in self.item_window_cols:
+                A[:, pos] = windows[:, j]
+
+        # 3. Score every candidate, then partial sort
+        scores = self.score_matrix(A)
+        final = scores[2]
+        top = np.argpartition(-final, k - 1)[:k]
+        top = top[np.argsort(-final[top], kind='stable')]
+        return pd.DataFrame({'item_id': item_ids[top], **dict(zip(SCORE_COLS, scores[:, top]))})
 
     def predict(self, user_features_df):
         """
@@ -66,24 +292,15 @@ class RecommendationServingEngine:
         2. Predict Causal Lift (Incremental impact of recommendation)
         3. Final Score = Hybrid(CTR, Lift)
         """
-        # Prepare data for XGBoost (DMatrix)
-        # Ensure feature order matches training!
-        dtest = xgb.DMatrix(user_features_df)
-
-        # 1. CTR Prediction
-        ctr_scores = self.ranker.predict(dtest)
-
-        # 2. Uplift Prediction (T-Learner)
-        lift_scores = self.uplift_model.predict_lift(user_features_df)
+        # 1 + 2. CTR and lift: every booster scores one float32 buffer built once, in the manifest's column order
+        scores = self.score_matrix(self.feature_matrix(user_features_df))
 
         # 3. Combine Results
-        results = user_features_df.copy()
-        results['predicted_ctr'] = ctr_scores
-        results['predicted_uplift'] = lift_scores
-
         # Strategy: Target "Persuadables" (High Lift) + High Quality Items (High CTR)
-        # Simple weight: 70% Lift + 30% CTR
-        results['final_score'] = (0.7 * results['predicted_uplift']) + (0.3 * results['predicted_ctr'])
+        # Simple weight: 70% Lift + 30% CTR (LIFT_WEIGHT)
+        results = user_features_df.copy()
+        for col, values in zip(SCORE_COLS, scores):
+            results[col] = values
 
         return results.sort_values('final_score', ascending=False)
 
@@ -96,25 +313,32 @@ if __name__ == "__main__":
         print(" Feature data not found. Run pipeline first.")
         exit(1)
 
-    features = pd.read_parquet(FEATURE_DATA_PATH).sample(10)  # Score 10 random users
-
-    # Drop non-feature columns
-    drop_cols = ['impression_id', 'user_id', 'item_id', 'impression_time',
-                 'clicked', 'added_to_cart', 'purchased', 'variant',
-                 'event_type', 'is_treated', 'transaction_id']
+    features = enforce_schema(pd.read_parquet(FEATURE_DATA_PATH).sample(10), FEATURE_SCHEMA)  # Score 10 random users
 
     # Keep IDs for display
     ids = features[['user_id', 'item_id']].reset_index(drop=True)
 
-    # Filter columns for model input
-    cols_to_drop = [c for c in drop_cols if c in features.columns]
-    scoring_data = features.drop(columns=cols_to_drop)
+    # Filter columns for model input (drop IDs, labels and other non-feature columns)
+    scoring_data = features[feature_columns(features)].copy()
 
     engine = RecommendationServingEngine()
+
+    # Serve counters from the live state store rather than the training snapshot
+    if engine.counters is not None:
+        counters = engine.current_counters(ids['user_id'], ids['item_id'])
+        for col, values in counters.items():
+            scoring_data[col] = values
+
     scored_users = engine.predict(scoring_data)
 
     # Attach IDs back for display
     final_output = pd.concat([ids, scored_users.reset_index(drop=True)], axis=1)
 
     print("\n Top Recommended Users/Items:")
-    print(final_output[['user_id', 'item_id', 'predicted_ctr', 'predicted_uplift', 'final_score']].head())
\ No newline at end of file
+    print(final_output[['user_id', 'item_id', 'predicted_ctr', 'predicted_uplift', 'final_score']].head())
+
+    # Top-K over every item in the feature store for one of the sampled users
+    if engine.store is not None:
+        user_id = int(ids['user_id'].iloc[0])
+        print(f"\n Top 5 items for user {user_id}:")
+        print(engine.recommend(user_id, k=5))
\ No newline at end of file
@@ -0,0 +1,182 @@
+import pandas as pd
+import numpy as np
+import xgboost as xgb
+import fcntl
+import json
+import os
+import shutil
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.models.uplift import LEARNERS
+from src.schema import FEATURE_SCHEMA
+
+# Versioned, pickle-free model bundle:
+#   models/bundle/<version>/manifest.json   feature list, dtypes, learner layout, training metadata
+#   models/bundle/<version>/<component>-<booster>.ubj   native XGBoost UBJSON boosters
+#   models/bundle/CURRENT                   name of the version serving should load
+#   models/bundle/.lock                     held while a version is published (see save_bundle)
+# A version directory is never modified after CURRENT points at it.
+BUNDLE_DIR = "models/bundle"
+FORMAT_VERSION = 1
+KEEP_VERSIONS = 3  # Older versions are pruned after each save
+
+
+def current_version(bundle_dir=BUNDLE_DIR):
+    path = os.path.join(bundle_dir, 'CURRENT')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip()
+
+
+def read_manifest(bundle_dir=BUNDLE_DIR, version=None):
+    version = version or current_version(bundle_dir)
+    if version is None:
+        return None
+    with open(os.path.join(bundle_dir, version, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def feature_spec(X):
+    """Feature list + dtypes of a training frame (or, for a list of names, their FEATURE_SCHEMA dtypes)."""
+    if hasattr(X, 'dtypes'):
+        return {'features': list(X.columns), 'dtypes': {c: str(X[c].dtype) for c in X.columns}}
+    return {'features': list(X), 'dtypes': {c: str(np.dtype(FEATURE_SCHEMA.get(c, np.float32))) for c in X}}
+
+
+def ranker_component(booster, X, **metadata):
+    """Manifest entry + boosters for the ranker; metadata (target, metrics, params...) is stored as-is."""
+    return {**feature_spec(X), 'metadata': metadata}, {'model': booster}
+
+
+def uplift_component(learner, X, **metadata):
+    state, boosters = learner.to_bundle()
+    return {**feature_spec(X), 'learner': {'type': learner.KIND, **state}, 'metadata': metadata}, boosters
+
+
+def tuning_config(bundle_dir=BUNDLE_DIR):
+    """Tuned configurations of the current bundle ({} before the first tuning run)."""
+    return (read_manifest(bundle_dir) or {}).get('tuning', {})
+
+
+def tuned_params(component, params, n_rounds, bundle_dir=BUNDLE_DIR):
+    """params / n_rounds with the tuned configuration of `component` (see tuning.py) applied, if there is one."""
+    tuning = tuning_config(bundle_dir).get(component)
+    if tuning is None:
+        return params, n_rounds
+    print(f"   Using tuned {component} config ({tuning['metric']} {tuning['score']:.4f}): "
+          f"{tuning['params']}, {tuning['n_rounds']} rounds")
+    return {**params, **tuning['params']}, tuning['n_rounds']
+
+
+def save_bundle(bundle_dir=BUNDLE_DIR, tuning=None, **components):
+    """
+    Writes a new bundle version with the given components (e.g. ranker=ranker_component(...)).
+    Components not given are carried over from the current version (hard-linked, not copied),
+    so the ranker and uplift model can be retrained independently. `tuning` ({component: config})
+    updates the tuned configurations, which are carried over the same way. Returns the new version.
+    Saves are serialized by a lock file: training stages running side by side (runner.MAX_WORKERS)
+    each build on the version the other published, so neither component is lost.
+    """
+    os.makedirs(bundle_dir, exist_ok=True)
+    with open(os.path.join(bundle_dir, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _publish(bundle_dir, tuning, components)
+
+
+def _publish(bundle_dir, tuning, components):
+    # Read the current manifest -> write the new version -> repoint CURRENT, all under the lock
+    previous = current_version(bundle_dir)
+    manifest = read_manifest(bundle_dir) or {'components': {}}
+    manifest['tuning'] = {**manifest.get('tuning', {}), **(tuning or {})}
+    version = pd.Timestamp.now(tz='UTC').strftime('%Y%m%dT%H%M%S%f')
+    target = os.path.join(bundle_dir, version)
+    os.makedirs(target)
+
+    for name, entry in manifest['components'].items():
+        if name not in components:
+            for file in entry['files'].values():
+                _link_or_copy(os.path.join(bundle_dir, previous, file), os.path.join(target, file))
+
+    for name, (entry, boosters) in components.items():
+        entry['files'] = {}
+        for key, booster in boosters.items():
+            file = f"{name}-{key}.ubj"
+            booster.save_model(os.path.join(target, file))
+            entry['files'][key] = file
+        entry['trained_at'] = version
+        manifest['components'][name] = entry
+
+    manifest.update(format_version=FORMAT_VERSION, version=version, xgboost_version=xgb.__version__)
+    with open(os.path.join(target, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+
+    # Publish: atomically repoint CURRENT, then drop old versions
+    tmp_path = os.path.join(bundle_dir, 'CURRENT.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(bundle_dir, 'CURRENT'))
+    _prune(bundle_dir, keep=version)
+    return version
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _prune(bundle_dir, keep):
+    versions = sorted(v for v in os.listdir(bundle_dir) if os.path.isdir(os.path.join(bundle_dir, v)))
+    for version in versions[:-KEEP_VERSIONS]:
+        if version != keep:
+            shutil.rmtree(os.path.join(bundle_dir, version), ignore_errors=True)
+
+
+def _load_booster(path):
+    booster = xgb.Booster()
+    booster.load_model(path)
+    return booster
+
+
+class ModelBundle:
+    """One loaded bundle version: ranker Booster, uplift learner and the manifest they came with."""
+
+    def __init__(self, manifest, ranker=None, uplift=None):
+        self.manifest = manifest
+        self.version = manifest['version']
+        self.ranker = ranker
+        self.uplift = uplift
+
+    def features(self, component='ranker'):
+        return self.manifest['components'][component]['features']
+
+    def metadata(self, component='ranker'):
+        return self.manifest['components'][component].get('metadata', {})
+
+
+def load_bundle(bundle_dir=BUNDLE_DIR, version=None):
+    """
+    Loads every component of a bundle version (default: CURRENT) in one call. XGBoost parses each
+    booster into its own tree structures, so every process holds a private copy of the models.
+    """
+    version = version or current_version(bundle_dir)
+    if version is None:
+        raise FileNotFoundError(f"No model bundle found in {bundle_dir}. Run 'make train' first.")
+    manifest = read_manifest(bundle_dir, version)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format {manifest.get('format_version')} (expected {FORMAT_VERSION}).")
+
+    loaded = {}
+    for name, entry in manifest['components'].items():
+        loaded[name] = {key: _load_booster(os.path.join(bundle_dir, version, file))
+                        for key, file in entry['files'].items()}
+
+    ranker = loaded['ranker']['model'] if 'ranker' in loaded else None
+    uplift = None
+    if 'uplift' in loaded:
+        state = dict(manifest['components']['uplift']['learner'])
+        uplift = LEARNERS[state.pop('type')].from_bundle(state, loaded['uplift'])
+    return ModelBundle(manifest, ranker=ranker, uplift=uplift)
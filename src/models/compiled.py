@@ -0,0 +1,109 @@
+import numpy as np
+import json
+
+# Objectives whose margin goes through a sigmoid (everything else used here is an identity link)
+LOGISTIC_OBJECTIVES = {'binary:logistic', 'reg:logistic'}
+
+
+def _base_margin(learner):
+    # base_score is stored as a string, as "[2.9E-1]" in newer XGBoost versions
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    if learner['objective']['name'] in LOGISTIC_OBJECTIVES:
+        return float(np.log(base_score / (1 - base_score)))
+    return base_score
+
+
+def _tree_tables(tree, offset):
+    """
+    One tree's node arrays in breadth-first order, so that the right child of a node is always
+    its left child + 1. Leaves point at themselves and never go right (threshold NaN, which no
+    value reaches, and NaN left), so rows that reach a leaf early simply stay there whatever the
+    feature value, +/-inf included. Child indices are shifted by `offset`.
+    """
+    if any(tree['split_type']):
+        raise ValueError("Categorical splits are not supported by the compiled predictor.")
+    left, right = tree['left_children'], tree['right_children']
+    order, depth = [0], [0]
+    new_left = []
+    for i in range(len(left)):  # `order` grows while we walk it
+        node = order[i]
+        if left[node] == -1:
+            new_left.append(i)
+        else:
+            new_left.append(len(order))
+            order += [left[node], right[node]]
+            depth += [depth[i] + 1] * 2
+        if i + 1 == len(order):
+            break
+    order = np.asarray(order)
+    leaf = np.asarray(left)[order] == -1
+    conditions = np.asarray(tree['split_conditions'], dtype=np.float32)[order]
+    return {
+        'feature': np.where(leaf, 0, np.asarray(tree['split_indices'])[order]),
+        'threshold': np.where(leaf, np.float32(np.nan), conditions),
+        'value': np.where(leaf, conditions, 0).astype(np.float32),  # Leaf value (learning rate applied)
+        'default_left': leaf | np.asarray(tree['default_left'], dtype=bool)[order],
+        'left': np.asarray(new_left) + offset,
+        'size': len(order),
+        'depth': max(depth)
+    }
+
+
+class CompiledForest:
+    """
+    Several XGBoost boosters flattened into one set of node arrays, evaluated together in NumPy.
+    Every tree of every booster advances one level per step over an (n_rows, n_trees) node matrix,
+    so a batch costs max_depth gathers no matter how many boosters share it. Built for small
+    serving batches, where DMatrix construction and per-booster predict calls dominate.
+    """
+
+    def __init__(self, boosters):
+        self.names = list(boosters)
+        self.feature_names = None
+        tables, roots, starts, base, logistic = [], [], [], [], []
+        offset = 0
+        for name, booster in boosters.items():
+            learner = json.loads(booster.save_raw('json'))['learner']
+            if self.feature_names is None:
+                self.feature_names = booster.feature_names
+            elif booster.feature_names != self.feature_names:
+                raise ValueError(f"Booster '{name}' was trained on different features.")
+            starts.append(len(roots))
+            for tree in learner['gradient_booster']['model']['trees']:
+                tables.append(_tree_tables(tree, offset))
+                roots.append(offset)
+                offset += tables[-1]['size']
+            base.append(_base_margin(learner))
+            logistic.append(learner['objective']['name'] in LOGISTIC_OBJECTIVES)
+
+        self.feature = np.concatenate([t['feature'] for t in tables]).astype(np.int32)
+        self.threshold = np.concatenate([t['threshold'] for t in tables])
+        self.value = np.concatenate([t['value'] for t in tables])
+        self.default_left = np.concatenate([t['default_left'] for t in tables])
+        self.left = np.concatenate([t['left'] for t in tables]).astype(np.int32)
+        self.max_depth = max(t['depth'] for t in tables)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.starts = np.asarray(starts, dtype=np.intp)
+        self.base_margin = np.asarray(base, dtype=np.float32)
+        self.logistic = np.asarray(logistic)
+
+    def predict(self, A):
+        """(n_boosters, n) predictions for a C-contiguous float32 matrix, in the order of `names`."""
+        A = np.ascontiguousarray(A, dtype=np.float32)
+        flat = A.ravel()
+        row_start = (np.arange(len(A), dtype=np.int32) * A.shape[1])[:, None]
+        has_nan = np.isnan(flat).any()
+        node = np.broadcast_to(self.roots, (len(A), len(self.roots)))
+        for _ in range(self.max_depth):
+            x = flat[row_start + self.feature[node]]
+            go_right = x >= self.threshold[node]
+            if has_nan:
+                go_right |= np.isnan(x) & ~self.default_left[node]
+            node = self.left[node] + go_right
+
+        # Leaf values summed per booster (trees of a booster are contiguous)
+        margin = np.add.reduceat(self.value[node], self.starts, axis=1).T + self.base_margin[:, None]
+        return np.where(self.logistic[:, None], 1 / (1 + np.exp(-margin)), margin)
+
+    def predict_dict(self, A):
+        return dict(zip(self.names, self.predict(A)))
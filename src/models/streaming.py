@@ -0,0 +1,179 @@
+import pandas as pd
+import numpy as np
+import pyarrow.parquet as pq
+import xgboost as xgb
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.models.sampling import SAMPLE_KEY, keep_negatives, row_keys
+from src.pipeline.incremental import list_parts
+from src.schema import FEATURE_SCHEMA, enforce_schema, feature_columns
+
+TIME_COL = 'impression_time'
+TARGET_COL = 'clicked'
+FALLBACK_TARGET_COL = 'purchased'  # Trained on instead when there are no click positives
+TRAINING_COLS = [TARGET_COL, FALLBACK_TARGET_COL, 'variant']  # Non-feature columns training reads (labels + arm)
+BATCH_ROWS = 1_000_000  # Rows handed to XGBoost per iterator step; bounds peak memory
+CACHE_DIR = "data/cache/xgb"  # External-memory pages
+
+
+def dataset_parts(path):
+    """Parquet parts of a dataset directory (or the single file of a legacy output)."""
+    return list_parts(path) if os.path.isdir(path) else [path]
+
+
+def _row_group_stats(parts, col):
+    # (num_rows, min, max) of `col` in every row group, from the Parquet footers only
+    stats = []
+    for part in parts:
+        meta = pq.ParquetFile(part).metadata
+        idx = meta.schema.to_arrow_schema().get_field_index(col)
+        for i in range(meta.num_row_groups):
+            rg = meta.row_group(i)
+            col_stats = rg.column(idx).statistics
+            if rg.num_rows and col_stats is not None and col_stats.has_min_max:
+                stats.append((rg.num_rows, col_stats.min, col_stats.max))
+    return stats
+
+
+def dataset_columns(parts):
+    return pq.read_schema(parts[0]).names
+
+
+def has_positives(parts, col):
+    """Whether a label column has any positive row (max statistic > 0), without reading data."""
+    stats = _row_group_stats(parts, col)
+    if not stats:
+        return any(pq.read_table(p, columns=[col]).column(col).to_numpy().any() for p in parts)
+    return max(s[2] for s in stats) > 0
+
+
+def training_target(data):
+    """
+    Label column every training script uses: TARGET_COL, or FALLBACK_TARGET_COL when `data` (a frame,
+    or Parquet parts, decided from their statistics) has no positives for it.
+    """
+    found = data[TARGET_COL].sum() > 0 if hasattr(data, 'columns') else has_positives(data, TARGET_COL)
+    if found:
+        target = TARGET_COL
+    else:
+        # RetailRocket doesn't have 'click' events (view IS the click), so predict conversion instead
+        print(f" Warning: '{TARGET_COL}' column has 0 positives (expected for RetailRocket).")
+        print(f"   -> Switching target to '{FALLBACK_TARGET_COL}' (Conversion).")
+        target = FALLBACK_TARGET_COL
+    print(f" Target Variable: {target}")
+    return target
+
+
+def holdout_cutoff(parts, holdout_fraction):
+    """
+    Time such that roughly the last `holdout_fraction` of rows lie at or after it, estimated from
+    row-group statistics (rows assumed uniform in time within a row group).
+    """
+    stats = _row_group_stats(parts, TIME_COL)
+    if not stats:
+        raise ValueError(f"No {TIME_COL} statistics found; cannot place a time-based holdout.")
+    rows = np.array([s[0] for s in stats], dtype=np.float64)
+    lo = np.array([pd.Timestamp(s[1]).value for s in stats], dtype=np.float64)
+    hi = np.array([pd.Timestamp(s[2]).value for s in stats], dtype=np.float64)
+
+    # Rows at or before time t, summed over row groups: bisect on t
+    target = (1 - holdout_fraction) * rows.sum()
+    t_lo, t_hi = lo.min(), hi.max()
+    for _ in range(64):
+        t = (t_lo + t_hi) / 2
+        frac = np.clip((t - lo) / np.maximum(hi - lo, 1), 0, 1)
+        if (rows * frac).sum() < target:
+            t_lo = t
+        else:
+            t_hi = t
+    return pd.Timestamp(int(t_hi))
+
+
+class ParquetBatchIter(xgb.DataIter):
+    """
+    Feeds a Parquet dataset to XGBoost one record batch at a time, keeping either the rows
+    before `cutoff` (training) or the rows at/after it (holdout). Nothing is materialized.
+    With negative_rate < 1, only that share of the negative rows is kept (see sampling.py);
+    the draw is per row key, so every pass keeps the same rows.
+    """
+
+    def __init__(self, parts, features, target, cutoff=None, holdout=False, cache_prefix=None, negative_rate=1.0):
+        self.parts = parts
+        self.features = features
+        self.target = target
+        self.cutoff = cutoff
+        self.holdout = holdout
+        self.negative_rate = negative_rate
+        self.n_rows = 0
+        self.negatives = [0, 0]  # (seen, kept) in the last pass
+        self._batches = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def _stream(self):
+        columns = self.features + [self.target] + ([TIME_COL] if self.cutoff is not None else [])
+        if self.negative_rate < 1 and SAMPLE_KEY in dataset_columns(self.parts):
+            columns.append(SAMPLE_KEY)
+        offset = 0
+        for part in self.parts:
+            for batch in pq.ParquetFile(part).iter_batches(batch_size=BATCH_ROWS, columns=columns):
+                df = enforce_schema(batch.to_pandas(), FEATURE_SCHEMA)
+                offset += len(df)
+                if self.cutoff is not None:
+                    after = (df[TIME_COL] >= self.cutoff).to_numpy()
+                    df = df[after if self.holdout else ~after]
+                if self.negative_rate < 1:
+                    negative = (df[self.target] <= 0).to_numpy()
+                    keep = ~negative | keep_negatives(row_keys(df, offset - len(df)), self.negative_rate)
+                    self.negatives[0] += negative.sum()
+                    self.negatives[1] += (negative & keep).sum()
+                    df = df[keep]
+                if len(df):
+                    yield df
+
+    @property
+    def realized_rate(self):
+        seen, kept = self.negatives
+        return kept / seen if self.negative_rate < 1 and seen else 1.0
+
+    def reset(self):
+        self._batches = None
+
+    def next(self, input_data):
+        if self._batches is None:
+            self.n_rows = 0
+            self.negatives = [0, 0]
+            self._batches = self._stream()
+        df = next(self._batches, None)
+        if df is None:
+            return False
+        self.n_rows += len(df)
+        input_data(data=df[self.features], label=df[self.target].to_numpy())
+        return True
+
+
+def external_memory_matrix(it, ref=None):
+    """External-memory quantile DMatrix where available (XGBoost >= 3.0), else an iterator DMatrix."""
+    if hasattr(xgb, 'ExtMemQuantileDMatrix'):
+        return xgb.ExtMemQuantileDMatrix(it, ref=ref)
+    return xgb.DMatrix(it)
+
+
+def streaming_split(path, target, holdout_fraction, negative_rate=1.0, cache_dir=CACHE_DIR):
+    """
+    Train / time-based holdout DMatrices streamed from the dataset at `path`, plus the feature list,
+    the cutoff and the realized negative rate of the training rows (the holdout is never sampled).
+    """
+    parts = dataset_parts(path)
+    features = feature_columns(dataset_columns(parts))
+    cutoff = holdout_cutoff(parts, holdout_fraction)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    train_it = ParquetBatchIter(parts, features, target, cutoff, cache_prefix=os.path.join(cache_dir, 'train'),
+                                negative_rate=negative_rate)
+    dtrain = external_memory_matrix(train_it)
+    holdout_it = ParquetBatchIter(parts, features, target, cutoff, holdout=True,
+                                  cache_prefix=os.path.join(cache_dir, 'holdout'))
+    dholdout = external_memory_matrix(holdout_it, ref=dtrain)
+    return dtrain, dholdout, features, cutoff, train_it.realized_rate
@@ -0,0 +1,137 @@
+import pandas as pd
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import roc_auc_score
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.models import train_ranker
+from src.models.bundle import BUNDLE_DIR, ranker_component, save_bundle, tuned_params, uplift_component
+from src.models.sampling import NEGATIVE_RATE, SAMPLE_KEY, negative_sample, row_keys
+from src.models.streaming import TIME_COL, TRAINING_COLS, dataset_parts, dataset_columns, training_target
+from src.ab_testing.assignment import variant_names
+from src.models.train_uplift import treatment_arm
+from src.models.uplift import ARM_PARAMS, ARM_ROUNDS, TLearnerUplift, run_arms
+from src.config import EXPERIMENT_CONFIG
+from src.schema import FEATURE_SCHEMA, enforce_schema, feature_columns
+
+# CONFIG
+DATA_PATH = "data/features/training_set.parquet"
+CHUNK_ROWS = 1_000_000  # Rows copied at a time when quantizing a subset
+
+
+class RowSubsetIter(xgb.DataIter):
+    """Feeds the rows `rows` of X / y to XGBoost in bounded chunks (the subset is never copied whole)."""
+
+    def __init__(self, X, y, rows, chunk_rows=CHUNK_ROWS):
+        self.X = X
+        self.y = y
+        self.rows = np.flatnonzero(rows)
+        self.chunk_rows = chunk_rows
+        self._pos = 0
+        super().__init__()
+
+    def reset(self):
+        self._pos = 0
+
+    def next(self, input_data):
+        if self._pos >= len(self.rows):
+            return False
+        idx = self.rows[self._pos:self._pos + self.chunk_rows]
+        input_data(data=self.X.iloc[idx], label=self.y[idx])
+        self._pos += self.chunk_rows
+        return True
+
+
+def subset_matrix(X, y, rows, ref=None):
+    """Quantizes a row subset; with `ref`, against ref's cut points (binning only, no re-sketching)."""
+    return xgb.QuantileDMatrix(RowSubsetIter(X, y, rows), ref=ref)
+
+
+def train_joint(negative_rate=NEGATIVE_RATE):
+    """
+    Trains the ranker and both T-Learner arms from one load of the training set. The features are
+    sketched once (the ranker's QuantileDMatrix); the control and treatment rows are then binned
+    against the same cut points straight from the frame, by index. (QuantileDMatrix cannot be
+    sliced, and zero-weighting rows of a full matrix would still pay histogram cost for them.)
+    Writes one bundle version with both models (what train_ranker.py + train_uplift.py produce).
+    """
+    print(" Loading Feature Data...")
+    if not os.path.exists(DATA_PATH):
+        raise FileNotFoundError(f" Data not found at {DATA_PATH}.")
+
+    # Only the columns some model uses
+    features = feature_columns(dataset_columns(dataset_parts(DATA_PATH)))
+    columns = features + [c for c in TRAINING_COLS + [TIME_COL] if c not in features]
+    if negative_rate < 1 and SAMPLE_KEY in dataset_columns(dataset_parts(DATA_PATH)):
+        columns.append(SAMPLE_KEY)
+    df = enforce_schema(pd.read_parquet(DATA_PATH, columns=columns), FEATURE_SCHEMA)
+
+    # Same target fallback as both training scripts (RetailRocket has no clicks)
+    target = training_target(df)
+    print(f"   Positive Rate: {df[target].mean():.4%}")
+
+    y = df[target].to_numpy(np.float32)
+    t = treatment_arm(df).to_numpy()
+    X = df[features]
+    data_through = df[TIME_COL].max()
+    keys = row_keys(df)
+    del df
+
+    # 1. Sketch once, on the ranker's training rows (same 80/20 split as train_ranker.py).
+    # This is the shared matrix: every other model bins its rows with these cut points.
+    _, test_idx = train_test_split(np.arange(len(y)), test_size=0.2, random_state=42)
+    is_test = np.zeros(len(y), dtype=bool)
+    is_test[test_idx] = True
+
+    # Every positive and a `negative_rate` sample of the negatives train; the test rows stay whole.
+    # Same per-row draw for both models; the ranker's rate is over its rows, the arms' per arm.
+    keep, arm_rates = negative_sample(y, keys, negative_rate, t, EXPERIMENT_CONFIG['n_variants'])
+    _, (ranker_rate,) = negative_sample(y[~is_test], keys[~is_test], negative_rate)
+    if negative_rate < 1:
+        print(f"   Negatives downsampled to {ranker_rate:.2%}: {(keep & ~is_test).sum():,} ranker rows.")
+    print(f" Quantizing {len(X):,} rows x {len(features)} features into a shared matrix...")
+    shared = subset_matrix(X, y, keep & ~is_test)
+
+    # 2. Ranker (test rows are scored straight from the frame, no quantization needed)
+    print(" Training XGBoost Ranker...")
+    ranker_params, ranker_rounds = tuned_params('ranker', train_ranker.XGB_PARAMS, train_ranker.N_ROUNDS)
+    ranker = xgb.train(ranker_params, shared, ranker_rounds)
+    auc = roc_auc_score(y[test_idx], ranker.inplace_predict(X.iloc[test_idx]))
+    print(f" Model Trained. Test AUC: {auc:.4f}")
+
+    # 3. T-Learner arms on the rows of each arm, binned with the same cut points, trained concurrently
+    arm_params, arm_rounds = tuned_params('uplift', ARM_PARAMS, ARM_ROUNDS)
+    names = variant_names(EXPERIMENT_CONFIG['n_variants'])
+    masks = [keep & (t == k) for k in range(len(names))]
+    for k, (name, mask) in enumerate(zip(names, masks)):
+        print(f"   Training {name} Model (T={k}) on {mask.sum()} samples...")
+
+    def arm_fit(mask):
+        return lambda n_threads: xgb.train({**arm_params, 'nthread': n_threads},
+                                           subset_matrix(X, y, mask, ref=shared), arm_rounds)
+
+    boosters = run_arms([arm_fit(mask) for mask in masks], [mask.sum() for mask in masks])
+    learner = TLearnerUplift.from_boosters(*boosters, negative_rates=arm_rates if negative_rate < 1 else None)
+    print(f" Training Complete. Sample Lift Predictions: {learner.predict_lift(X.head())}")
+
+    # 4. Both models go into one bundle version
+    version = save_bundle(
+        ranker=ranker_component(ranker, X, target=target, auc=auc, n_rows=int((keep & ~is_test).sum()),
+                                params=ranker_params, n_rounds=ranker_rounds, negative_rate=ranker_rate,
+                                **train_ranker.full_retrain_lineage(data_through)),
+        uplift=uplift_component(learner, X, target=target, n_rows=int(keep.sum()), params=arm_params,
+                                n_rounds=arm_rounds)
+    )
+    print(f" Models saved to {BUNDLE_DIR}/{version}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--negative-rate', type=float, default=NEGATIVE_RATE,
+                        help="Share of negative rows kept for training (1.0 = all)")
+    args = parser.parse_args()
+    train_joint(args.negative_rate)
@@ -2,42 +2,54 @@ import pandas as pd
 import xgboost as xgb
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score
+import argparse
 import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.models.bundle import BUNDLE_DIR, load_bundle, ranker_component, read_manifest, save_bundle, tuned_params
+from src.models.sampling import NEGATIVE_RATE, negative_sample, row_keys
+from src.models.streaming import TIME_COL, dataset_parts, streaming_split, training_target
+from src.schema import FEATURE_SCHEMA, enforce_schema, feature_columns
 
 # CONFIG
 DATA_PATH = "data/features/training_set.parquet"
-MODEL_DIR = "models/ranking"
-MODEL_PATH = os.path.join(MODEL_DIR, "xgb_ranker.json")
+HOLDOUT_FRACTION = 0.2  # External-memory mode: the latest 20% of impressions (by time) are held out
+
+# Same model as the in-memory XGBClassifier, in native xgb.train form
+XGB_PARAMS = {
+    'objective': 'binary:logistic',
+    'eval_metric': 'auc',
+    'learning_rate': 0.1,
+    'max_depth': 5,
+    'tree_method': 'hist'
+}
+N_ROUNDS = 100
+
+# Incremental mode: trees added per refresh, and how often to retrain from scratch instead
+INCREMENTAL_ROUNDS = 20
+FULL_RETRAIN_DAYS = 7
+AUC_TOLERANCE = 0.002  # A refreshed model may lose at most this much holdout AUC vs the previous one
+
+
+def full_retrain_lineage(data_through):
+    """Ranker metadata that starts a new warm-start chain (see train_ranker_incremental)."""
+    return {'data_through': data_through, 'full_retrain_at': pd.Timestamp.now(tz='UTC'), 'incremental_runs': 0}
 
 
-def train_ranker():
+def train_ranker(negative_rate=NEGATIVE_RATE):
     print(" Loading Feature Data...")
     if not os.path.exists(DATA_PATH):
         raise FileNotFoundError(f" Data not found at {DATA_PATH}.")
 
-    df = pd.read_parquet(DATA_PATH)
+    df = enforce_schema(pd.read_parquet(DATA_PATH), FEATURE_SCHEMA)
 
-    # FOR RETAILROCKET DATA
-    # RetailRocket doesn't have 'click' events (view IS the click).
-    # We must predict a real outcome: 'purchased' (or 'added_to_cart').
-
-    # Check if we have any positive labels for 'clicked'
-    if df['clicked'].sum() == 0:
-        print(" Warning: 'clicked' column has 0 positives (expected for RetailRocket).")
-        print("   -> Switching target to 'purchased' (Conversion).")
-        target = 'purchased'
-    else:
-        target = 'clicked'
-
-    print(f" Target Variable: {target}")
+    # FOR RETAILROCKET DATA: no positive 'clicked' labels, so the real outcome 'purchased' is predicted
+    target = training_target(df)
     print(f"   Positive Rate: {df[target].mean():.4%}")
 
-    # Drop IDs, leaks, and the target itself
-    drop_cols = ['impression_id', 'user_id', 'item_id', 'impression_time',
-                 'clicked', 'added_to_cart', 'purchased', 'variant', 'event_type',
-                 'transaction_id']  # transaction_id is a leak if present
-
-    features = [c for c in df.columns if c not in drop_cols]
+    # Drop IDs, leaks, and the target itself (transaction_id is a leak if present)
+    features = feature_columns(df)
 
     print(f"   Training on {len(features)} features: {features}")
 
@@ -47,16 +59,17 @@ def train_ranker():
     # Split
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
-    # Train XGBoost
+    # Keep every positive and a `negative_rate` sample of the negatives (the test set stays whole)
+    keep, (rate,) = negative_sample(y_train, row_keys(df.loc[y_train.index]), negative_rate)
+    if rate < 1:
+        X_train, y_train = X_train[keep], y_train[keep]
+        print(f"   Negatives downsampled to {rate:.2%}: training on {len(X_train):,} rows.")
+
+    # Train XGBoost (XGB_PARAMS / N_ROUNDS, or the configuration found by tuning.py)
     # Removed 'use_label_encoder' to fix warning
     print(" Training XGBoost Ranker...")
-    model = xgb.XGBClassifier(
-        objective='binary:logistic',
-        eval_metric='auc',
-        n_estimators=100,
-        learning_rate=0.1,
-        max_depth=5
-    )
+    params, n_rounds = tuned_params('ranker', XGB_PARAMS, N_ROUNDS)
+    model = xgb.XGBClassifier(n_estimators=n_rounds, **params)
 
     model.fit(X_train, y_train)
 
@@ -65,11 +78,147 @@ def train_ranker():
     auc = roc_auc_score(y_test, preds)
     print(f" Model Trained. Test AUC: {auc:.4f}")
 
-    # Save
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    model.save_model(MODEL_PATH)
-    print(f" Model saved to {MODEL_PATH}")
+    # Save (the uplift model of the current bundle is carried over)
+    version = save_bundle(ranker=ranker_component(model.get_booster(), X, target=target, auc=auc,
+                                                  n_rows=len(X_train), params=params, n_rounds=n_rounds,
+                                                  negative_rate=rate, **full_retrain_lineage(df[TIME_COL].max())))
+    print(f" Model saved to {BUNDLE_DIR}/{version}")
+
+
+def train_ranker_external(negative_rate=NEGATIVE_RATE):
+    """
+    Out-of-core variant of train_ranker(): Parquet record batches are streamed through an
+    XGBoost data iterator into external-memory quantile pages, and the newest HOLDOUT_FRACTION
+    of impressions (cutoff placed from row-group statistics) is streamed separately for evaluation.
+    Peak memory is bounded by one batch plus the quantized pages, not by the dataset size.
+    """
+    print(" Streaming Feature Data (external memory)...")
+    if not os.path.exists(DATA_PATH):
+        raise FileNotFoundError(f" Data not found at {DATA_PATH}.")
+
+    # Same target fallback as train_ranker(), decided from Parquet statistics
+    target = training_target(dataset_parts(DATA_PATH))
+
+    dtrain, dholdout, features, cutoff, rate = streaming_split(DATA_PATH, target, HOLDOUT_FRACTION, negative_rate)
+    print(f"   Training on {dtrain.num_row():,} rows before {cutoff}, holding out {dholdout.num_row():,} after it.")
+    print(f"   Training on {len(features)} features: {features}")
+
+    print(" Training XGBoost Ranker...")
+    params, n_rounds = tuned_params('ranker', XGB_PARAMS, N_ROUNDS)
+    evals_result = {}
+    booster = xgb.train(params, dtrain, num_boost_round=n_rounds,
+                        evals=[(dholdout, 'holdout')], evals_result=evals_result, verbose_eval=False)
+    auc = evals_result['holdout']['auc'][-1]
+    print(f" Model Trained. Holdout AUC: {auc:.4f}")
+
+    version = save_bundle(ranker=ranker_component(booster, features, target=target, auc=auc,
+                                                  n_rows=dtrain.num_row(), holdout_cutoff=cutoff,
+                                                  params=params, n_rounds=n_rounds,
+                                                  negative_rate=rate, **full_retrain_lineage(cutoff)))
+    print(f" Model saved to {BUNDLE_DIR}/{version}")
+
+
+def train_ranker_incremental():
+    """
+    Warm-start refresh: continues boosting the current ranker with INCREMENTAL_ROUNDS trees fit on
+    the rows newer than the ones it was trained on (its `data_through`), read with a Parquet filter
+    so old partitions are skipped. The newest HOLDOUT_FRACTION of the new rows scores the old and
+    the refreshed model; a refresh that loses more than AUC_TOLERANCE is discarded. Falls back to
+    a full train_ranker() when there is no model to start from, the features changed, or the last
+    full retrain is more than FULL_RETRAIN_DAYS old. A fallback retrain keeps the current ranker's
+    negative rate.
+    """
+    manifest = read_manifest()
+    previous = (manifest or {}).get('components', {}).get('ranker')
+    meta = (previous or {}).get('metadata', {})
+    negative_rate = meta.get('negative_rate', NEGATIVE_RATE)
+    if 'data_through' not in meta:
+        print(" No ranker to warm-start from. Running a full retrain...")
+        return train_ranker(negative_rate)
+    age = pd.Timestamp.now(tz='UTC') - pd.Timestamp(meta['full_retrain_at'])
+    if age > pd.Timedelta(days=FULL_RETRAIN_DAYS):
+        print(f" Last full retrain was {age.days} days ago (schedule: every {FULL_RETRAIN_DAYS}). Running a full retrain...")
+        return train_ranker(negative_rate)
+
+    # 1. Only the rows that arrived after the current model's training data
+    data_through = pd.Timestamp(meta['data_through'])
+    print(f" Loading feature rows after {data_through}...")
+    df = pd.read_parquet(DATA_PATH, filters=[(TIME_COL, '>', data_through)])
+    df = enforce_schema(df, FEATURE_SCHEMA).sort_values(TIME_COL)
+    if feature_columns(df) != previous['features']:
+        print(" Feature set changed since the last full retrain. Running a full retrain...")
+        return train_ranker(negative_rate)
+    if df.empty:
+        print(" No new rows since the last training run. Nothing to do.")
+        return
+
+    # 2. Time-based holdout: the newest rows judge both models
+    target = meta['target']
+    cutoff = df[TIME_COL].quantile(1 - HOLDOUT_FRACTION)
+    is_holdout = (df[TIME_COL] >= cutoff).to_numpy()
+    train, holdout = df[~is_holdout], df[is_holdout]
+    if train.empty:
+        print(" Too few new rows to hold some out. Nothing to do.")
+        return
+    # Same negative rate as the rest of the chain, so one calibration fits every tree
+    keep, _ = negative_sample(train[target], row_keys(train), meta.get('negative_rate', 1.0))
+    train = train[keep]
+    X_train = train[previous['features']]
+    X_holdout = holdout[previous['features']]
+    print(f"   {len(train):,} new rows to train on, {len(holdout):,} held out (from {cutoff}).")
+
+    # 3. Continue boosting from the current booster
+    old = load_bundle().ranker
+    params = meta['params']
+    print(f" Adding {INCREMENTAL_ROUNDS} trees to the current {old.num_boosted_rounds()}...")
+    dtrain = xgb.QuantileDMatrix(X_train, label=train[target])
+    booster = xgb.train(params, dtrain, INCREMENTAL_ROUNDS, xgb_model=old.copy())
+
+    # 4. Compare on the holdout (skipped when it has a single class)
+    if holdout[target].nunique() < 2:
+        print("   Holdout has a single class; accepting the refresh without an AUC comparison.")
+        old_auc = auc = None
+    else:
+        old_auc = roc_auc_score(holdout[target], old.inplace_predict(X_holdout))
+        auc = roc_auc_score(holdout[target], booster.inplace_predict(X_holdout))
+        print(f" Holdout AUC: previous {old_auc:.4f} -> refreshed {auc:.4f}")
+        if auc < old_auc - AUC_TOLERANCE:
+            print(" Refreshed model is worse than the current one. Keeping the current model.")
+            return
+
+    # 5. Save; the next refresh starts after the last row trained on (the holdout rows are trained next time)
+    version = save_bundle(ranker=ranker_component(
+        booster, X_train, target=target, auc=auc, previous_auc=old_auc, n_rows=len(train),
+        negative_rate=meta.get('negative_rate', 1.0), params=params, n_rounds=booster.num_boosted_rounds(), data_through=train[TIME_COL].max(),
+        full_retrain_at=meta['full_retrain_at'], incremental_runs=meta.get('incremental_runs', 0) + 1
+    ))
+    print(f" Model saved to {BUNDLE_DIR}/{version}")
+
+
+def refresh_ranker(incremental=False, n_shards=None, negative_rate=NEGATIVE_RATE):
+    """
+    Runner entry point: warm-start refresh on incremental runs (at the current ranker's negative
+    rate), full retrain at `negative_rate` otherwise.
+    """
+    if incremental:
+        train_ranker_incremental()
+    else:
+        train_ranker(negative_rate)
 
 
 if __name__ == "__main__":
-    train_ranker()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--external-memory', action='store_true',
+                      help="Stream the training set from Parquet instead of loading it into memory")
+    mode.add_argument('--incremental', action='store_true',
+                      help="Warm-start from the current ranker with trees fit on the new rows only")
+    parser.add_argument('--negative-rate', type=float, default=NEGATIVE_RATE,
+                        help="Share of negative rows kept for training (full retrains; 1.0 = all)")
+    args = parser.parse_args()
+    if args.external_memory:
+        train_ranker_external(args.negative_rate)
+    elif args.incremental:
+        train_ranker_incremental()
+    else:
+        train_ranker(args.negative_rate)
\ No newline at end of file
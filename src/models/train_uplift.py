@@ -1,108 +1,93 @@
 import pandas as pd
-import xgboost as xgb
-import joblib
+import argparse
 import os
+import sys
 import numpy as np
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.ab_testing.assignment import variant_names
+from src.models.bundle import BUNDLE_DIR, save_bundle, tuned_params, uplift_component
+from src.models.sampling import NEGATIVE_RATE, negative_sample, row_keys
+from src.models.streaming import training_target
+from src.models.uplift import ARM_PARAMS, ARM_ROUNDS, LEARNERS
+from src.config import EXPERIMENT_CONFIG
+from src.schema import FEATURE_SCHEMA, enforce_schema, feature_columns
+
 # CONFIG
 DATA_PATH = "data/features/training_set.parquet"
-MODEL_DIR = "models/uplift"
-MODEL_PATH = os.path.join(MODEL_DIR, "uplift_meta_learner.pkl")
-
-
-class TLearnerUplift:
-    """
-    Simple T-Learner implementation using two XGBoost models.
-    Model 0: Predicts outcome given Control.
-    Model 1: Predicts outcome given Treatment.
-    Lift = Model 1 - Model 0
-    """
-
-    def __init__(self):
-        # We use slightly shallower trees for Uplift to prevent overfitting on the treatment effect
-        self.m0 = xgb.XGBClassifier(objective='binary:logistic', n_estimators=50, max_depth=3)
-        self.m1 = xgb.XGBClassifier(objective='binary:logistic', n_estimators=50, max_depth=3)
-
-    def fit(self, X, y, t):
-        # Train Control Model (t=0)
-        print(f"   Training Control Model (T=0) on {sum(t == 0)} samples...")
-        if y[t == 0].nunique() < 2:
-            print("   ️ Warning: Control group has constant outcome. Model will predict constant.")
-            # Dummy fit or skip - for robust code we let XGBoost handle it or handle specific edge case
-            # But swapping target to 'purchased' usually fixes this.
-
-        self.m0.fit(X[t == 0], y[t == 0])
-
-        # Train Treatment Model (t=1)
-        print(f"   Training Treatment Model (T=1) on {sum(t == 1)} samples...")
-        self.m1.fit(X[t == 1], y[t == 1])
-
-    def predict_lift(self, X):
-        # Predict Prob(Conversion | Control)
-        p0 = self.m0.predict_proba(X)[:, 1]
-        # Predict Prob(Conversion | Treatment)
-        p1 = self.m1.predict_proba(X)[:, 1]
-        # Uplift = P(Treatment) - P(Control)
-        return p1 - p0
-
-
-def train_uplift_model():
+
+UPLIFT_LEARNER = 't'  # 't', 's' or 'x' (see src/models/uplift.py)
+
+
+def treatment_arm(df, n_arms=None):
+    """int8 experiment arm per row (0 = Control, k = k-th treatment) from the 'variant' column."""
+    n_arms = n_arms or EXPERIMENT_CONFIG['n_variants']
+    if 'variant' in df.columns:
+        # Assuming synthetic pipeline set 'Control' / 'Treatment' (or 'Treatment_k')
+        # Or if we ran ingest_retailrocket, we might not have 'variant' yet.
+        # Let's verify string matching; unknown labels count as Control
+        # (variant is categorical, so map() only evaluates the lambda once per category)
+        arms = {name.lower(): k for k, name in enumerate(variant_names(n_arms))}
+        return df['variant'].map(lambda x: arms.get(str(x).lower(), 0)).astype(np.int8)
+    # If we are running on pure RetailRocket data without the synthetic pipeline's AB assignment,
+    # we need to simulate a Randomized Control Trial (RCT) for training purposes.
+    print(f"    No 'variant' column found. Simulating a uniform {n_arms}-arm RCT assignment.")
+    np.random.seed(42)
+    return pd.Series(np.random.randint(0, n_arms, size=len(df)).astype(np.int8), index=df.index)
+
+
+def train_uplift_model(learner_type=UPLIFT_LEARNER, negative_rate=NEGATIVE_RATE):
     print(" Loading Data for Uplift Modeling...")
     if not os.path.exists(DATA_PATH):
         raise FileNotFoundError(f" Data not found at {DATA_PATH}")
 
-    df = pd.read_parquet(DATA_PATH)
+    df = enforce_schema(pd.read_parquet(DATA_PATH), FEATURE_SCHEMA)
 
     # 1. Handle Treatment Column
-    if 'variant' in df.columns:
-        # Assuming synthetic pipeline set 'Treatment' / 'Control'
-        # Or if we ran ingest_retailrocket, we might not have 'variant' yet.
-        # Let's verify string matching
-        df['is_treated'] = df['variant'].apply(lambda x: 1 if str(x).lower() == 'treatment' else 0)
-    else:
-        # If we are running on pure RetailRocket data without the synthetic pipeline's AB assignment,
-        # we need to simulate a Randomized Control Trial (RCT) for training purposes.
-        print("    No 'variant' column found. Simulating 50/50 RCT assignment.")
-        np.random.seed(42)
-        df['is_treated'] = np.random.randint(0, 2, size=len(df))
+    df['is_treated'] = treatment_arm(df)
 
     # 2. Handle Target Variable (Fix for RetailRocket)
     # If clicks are empty, use purchases
-    if df['clicked'].sum() == 0:
-        print("  Warning: 'clicked' has 0 positives. Switching target to 'purchased'.")
-        target = 'purchased'
-    else:
-        target = 'clicked'
-
-    print(f" Target Variable: {target}")
+    target = training_target(df)
     print(f"   Positive Rate: {df[target].mean():.4%}")
 
+    # Keep every positive and a `negative_rate` sample of each arm's negatives
+    if learner_type == 'x' and negative_rate < 1:
+        print("   Note: the X-Learner's effect models need every row; training without downsampling.")
+        negative_rate = 1.0
+    n_arms = EXPERIMENT_CONFIG['n_variants']
+    keep, rates = negative_sample(df[target], row_keys(df), negative_rate, df['is_treated'], n_arms)
+    if negative_rate < 1:
+        df = df[keep]
+        print(f"   Negatives downsampled to {', '.join(f'{r:.2%}' for r in rates)} (per arm): {len(df):,} rows.")
+
     # 3. Define Features
     # Drop IDs, leaks, targets, and text columns
-    drop_cols = ['impression_id', 'user_id', 'item_id', 'impression_time',
-                 'clicked', 'added_to_cart', 'purchased', 'variant', 'is_treated',
-                 'event_type', 'transaction_id']
-
-    features = [c for c in df.columns if c not in drop_cols]
+    features = feature_columns(df)
 
     X = df[features]
     y = df[target]  # Target
-    t = df['is_treated']  # Treatment Indicator
-
-    print(f"   Training T-Learner on {len(X)} samples using features: {features}")
+    t = df['is_treated']  # Experiment arm (0 = Control)
 
-    learner = TLearnerUplift()
-    learner.fit(X, y, t)
+    params, n_rounds = tuned_params('uplift', ARM_PARAMS, ARM_ROUNDS)
+    learner = LEARNERS[learner_type](params=params, n_rounds=n_rounds)
+    print(f"   Training {type(learner).__name__} on {len(X)} samples using features: {features}")
+    learner.fit(X, y, t, negative_rates=rates if negative_rate < 1 else None)
 
     # Sanity Check
     sample_lift = learner.predict_lift(X.head())
     print(f" Training Complete. Sample Lift Predictions: {sample_lift}")
 
-    # Save Artifact
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    joblib.dump(learner, MODEL_PATH)
-    print(f" Uplift Model saved to {MODEL_PATH}")
+    # Save Artifact (the ranker of the current bundle is carried over)
+    version = save_bundle(uplift=uplift_component(learner, X, target=target, n_rows=len(X),
+                                                    params=params, n_rounds=n_rounds))
+    print(f" Uplift Model saved to {BUNDLE_DIR}/{version}")
 
 
 if __name__ == "__main__":
-    train_uplift_model()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--learner', choices=sorted(LEARNERS), default=UPLIFT_LEARNER, help="Uplift meta-learner")
+    parser.add_argument('--negative-rate', type=float, default=NEGATIVE_RATE,
+                        help="Share of each arm's negative rows kept for training (1.0 = all)")
+    args = parser.parse_args()
+    train_uplift_model(args.learner, args.negative_rate)
\ No newline at end of file
@@ -0,0 +1,174 @@
+import pandas as pd
+import numpy as np
+import xgboost as xgb
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import roc_auc_score
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.evaluation.metrics import qini_area
+from src.models import train_ranker
+from src.models.bundle import BUNDLE_DIR, save_bundle
+from src.models.train_uplift import treatment_arm
+from src.models.uplift import ARM_PARAMS, N_JOBS, as_matrix
+from src.models.streaming import TRAINING_COLS, dataset_parts, dataset_columns, training_target
+from src.config import EXPERIMENT_CONFIG
+from src.schema import FEATURE_SCHEMA, enforce_schema, feature_columns
+
+# CONFIG
+DATA_PATH = "data/features/training_set.parquet"
+SEARCH_SPACE = {
+    'max_depth': [3, 4, 5, 6, 8],
+    'learning_rate': [0.03, 0.05, 0.1, 0.2, 0.3],
+    'min_child_weight': [1, 5, 20, 50],
+    'subsample': [0.7, 0.85, 1.0],
+    'colsample_bytree': [0.6, 0.8, 1.0],
+    'reg_lambda': [1, 5, 20]
+}
+N_TRIALS = 16
+ETA = 3  # Successive halving: the best 1/ETA of a rung go on, with ETA x the rounds
+MIN_ROUNDS = 30  # Budget of the first rung
+MAX_ROUNDS = 270  # Budget of the last rung
+EVAL_EVERY = 10  # Rounds between validation checks
+PATIENCE = 30  # A trial stops after this many rounds without a better validation score
+VALID_FRACTION = 0.2  # Of the rows left after train_ranker.py's test split
+N_WORKERS = max(1, min(4, N_JOBS))  # Trials trained at once; each gets N_JOBS // N_WORKERS threads
+SEED = 42
+
+# Per-process tuning data, built once by _init_worker and reused by every trial the process runs
+_DATA = {}
+
+
+def load_tuning_data(model):
+    """
+    Quantized training matrices + raw validation rows for `model` ('ranker' or 'uplift').
+    The test rows of train_ranker.py's 80/20 split are left out, so tuning never sees them.
+    """
+    features = feature_columns(dataset_columns(dataset_parts(DATA_PATH)))
+    columns = features + [c for c in TRAINING_COLS if c not in features]
+    df = enforce_schema(pd.read_parquet(DATA_PATH, columns=columns), FEATURE_SCHEMA)
+    target = training_target(df)  # Same fallback as training
+
+    y = df[target].to_numpy(np.float32)
+    t = treatment_arm(df).to_numpy()
+    X = df[features]
+    rest, _ = train_test_split(np.arange(len(y)), test_size=0.2, random_state=42)
+    train, valid = train_test_split(rest, test_size=VALID_FRACTION, random_state=SEED)
+
+    if model == 'ranker':
+        dtrains = [xgb.QuantileDMatrix(X.iloc[train], label=y[train])]
+        params = {k: v for k, v in train_ranker.XGB_PARAMS.items() if k != 'eval_metric'}
+    else:
+        dtrains = [xgb.QuantileDMatrix(X.iloc[train[t[train] == k]], label=y[train[t[train] == k]])
+                   for k in range(EXPERIMENT_CONFIG['n_variants'])]
+        params = ARM_PARAMS
+    return {'model': model, 'target': target, 'dtrains': dtrains, 'params': params,
+            'A_valid': as_matrix(X.iloc[valid]), 'y_valid': y[valid], 't_valid': t[valid]}
+
+
+def validation_score(data, preds):
+    """Ranker: AUC. Uplift: Qini area of each treatment arm's lift over Control, averaged over arms."""
+    y, t = data['y_valid'], data['t_valid']
+    if data['model'] == 'ranker':
+        return float(roc_auc_score(y, preds[0]))
+    scores = []
+    for k in range(1, len(preds)):
+        rows = (t == 0) | (t == k)
+        scores.append(qini_area(y[rows], preds[k][rows] - preds[0][rows], t[rows] == k))
+    return float(np.mean(scores))
+
+
+def _init_worker(model, n_threads):
+    _DATA.update(load_tuning_data(model), n_threads=n_threads)
+
+
+def advance(trial, budget):
+    """
+    Continues a trial's boosters (one for the ranker, one per arm for uplift) up to `budget` rounds,
+    EVAL_EVERY rounds at a time, scoring the validation rows after each step. Stops early once the
+    score has not improved for PATIENCE rounds. Boosters travel between processes as UBJSON bytes.
+    """
+    params = {**_DATA['params'], **trial['params'], 'nthread': _DATA['n_threads'], 'seed': SEED}
+    boosters = [xgb.Booster(model_file=raw) for raw in trial['models']] or [None] * len(_DATA['dtrains'])
+    while trial['rounds'] < budget and not trial['stopped']:
+        step = min(EVAL_EVERY, budget - trial['rounds'])
+        boosters = [xgb.train(params, d, step, xgb_model=b) for d, b in zip(_DATA['dtrains'], boosters)]
+        trial['rounds'] += step
+        preds = [b.inplace_predict(_DATA['A_valid']) for b in boosters]
+        trial['history'].append((trial['rounds'], validation_score(_DATA, preds)))
+        best_rounds, trial['score'] = max(trial['history'], key=lambda h: h[1])
+        trial['best_rounds'] = best_rounds
+        trial['stopped'] = trial['rounds'] - best_rounds >= PATIENCE
+    trial['models'] = [b.save_raw('ubj') for b in boosters if b is not None]
+    return trial
+
+
+def sample_configs(n_trials, seed=SEED):
+    rng = np.random.default_rng(seed)
+    return [{k: rng.choice(v).item() for k, v in SEARCH_SPACE.items()} for _ in range(n_trials)]
+
+
+def successive_halving(model, n_trials=N_TRIALS, n_workers=N_WORKERS):
+    """
+    Successive halving over sampled configs: every trial gets MIN_ROUNDS, the best 1/ETA continue
+    with ETA x the rounds, and so on up to MAX_ROUNDS. Bad configs are dropped after a few dozen
+    rounds instead of being trained in full. Returns the best trial and the total rounds trained.
+    """
+    trials = [{'id': i, 'params': p, 'models': [], 'rounds': 0, 'history': [], 'score': -np.inf,
+               'best_rounds': 0, 'stopped': False} for i, p in enumerate(sample_configs(n_trials))]
+    n_threads = max(1, N_JOBS // n_workers)
+    print(f" Tuning {model}: {n_trials} trials, {n_workers} workers x {n_threads} threads")
+
+    active, budget = trials, MIN_ROUNDS
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(model, n_threads)) as pool:
+        while True:
+            active = list(pool.map(advance, active, [budget] * len(active)))
+            for trial in active:
+                trials[trial['id']] = trial
+            active.sort(key=lambda tr: tr['score'], reverse=True)
+            best = active[0]
+            print(f"   {len(active)} trials @ {budget} rounds: best {best['score']:.4f} "
+                  f"(trial {best['id']}, {best['best_rounds']} rounds)")
+            if budget >= MAX_ROUNDS or len(active) == 1:
+                break
+            active = active[:max(1, len(active) // ETA)]
+            budget = min(budget * ETA, MAX_ROUNDS)
+
+    best = max(trials, key=lambda tr: tr['score'])
+    return best, sum(tr['rounds'] for tr in trials)
+
+
+def tune(models=('ranker', 'uplift'), n_trials=N_TRIALS, n_workers=N_WORKERS):
+    if not os.path.exists(DATA_PATH):
+        raise FileNotFoundError(f" Data not found at {DATA_PATH}.")
+
+    tuning = {}
+    for model in models:
+        best, total_rounds = successive_halving(model, n_trials, n_workers)
+        tuning[model] = {
+            'params': best['params'],
+            'n_rounds': best['best_rounds'],
+            'metric': 'auc' if model == 'ranker' else 'qini',
+            'score': best['score'],
+            'n_trials': n_trials,
+            'rounds_trained': total_rounds  # vs n_trials * MAX_ROUNDS for an exhaustive search
+        }
+        print(f" Best {model} config: {best['params']}, {best['best_rounds']} rounds "
+              f"({total_rounds:,} rounds trained vs {n_trials * MAX_ROUNDS:,} exhaustive)")
+
+    # The current models are carried over; the next training run picks the configuration up
+    version = save_bundle(tuning=tuning)
+    print(f" Tuned configuration saved to {BUNDLE_DIR}/{version}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', choices=['ranker', 'uplift', 'all'], default='all', help="Which model to tune")
+    parser.add_argument('--trials', type=int, default=N_TRIALS, help="Configurations sampled")
+    parser.add_argument('--workers', type=int, default=N_WORKERS, help="Trials trained in parallel")
+    args = parser.parse_args()
+    tune(('ranker', 'uplift') if args.model == 'all' else (args.model,), args.trials, args.workers)
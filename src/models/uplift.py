@@ -0,0 +1,290 @@
+import numpy as np
+import xgboost as xgb
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.ab_testing.assignment import variant_names
+from src.config import EXPERIMENT_CONFIG
+from src.models.sampling import calibrate
+
+# We use slightly shallower trees for Uplift to prevent overfitting on the treatment effect
+ARM_PARAMS = {'objective': 'binary:logistic', 'max_depth': 3}
+EFFECT_PARAMS = {'objective': 'reg:squarederror', 'max_depth': 3}  # X-Learner imputed-effect regressors
+ARM_ROUNDS = 50
+N_JOBS = os.cpu_count() or 1  # Total cores for uplift training, split across concurrently trained models
+
+
+def thread_budget(sizes, n_jobs=N_JOBS):
+    """Splits n_jobs threads across concurrent fits in proportion to their row counts (at least 1 each)."""
+    sizes = np.maximum(np.asarray(sizes, dtype=np.float64), 1)
+    if n_jobs <= len(sizes):
+        return [1] * len(sizes)
+    share = sizes / sizes.sum() * n_jobs
+    threads = np.maximum(np.floor(share).astype(int), 1)
+    # Hand leftover threads to the fits that lost the most to rounding down
+    for k in np.argsort(threads - share)[:max(n_jobs - threads.sum(), 0)]:
+        threads[k] += 1
+    return threads.tolist()
+
+
+def run_arms(fits, sizes, n_jobs=N_JOBS):
+    """
+    Runs one fit per arm concurrently; each fit(n_threads) gets its share of the thread budget.
+    XGBoost releases the GIL while training, so threads run the arms truly in parallel
+    (at most n_jobs at a time, so small boxes are not oversubscribed either).
+    """
+    threads = thread_budget(sizes, n_jobs)
+    with ThreadPoolExecutor(max_workers=max(1, min(len(fits), n_jobs))) as pool:
+        return list(pool.map(lambda fit, n: fit(n), fits, threads))
+
+
+def as_matrix(X, features=None):
+    """
+    Feature frame/array -> one C-contiguous float32 matrix, converted once per predict call.
+    Frames are reordered to `features` (the training columns) first; arrays are taken as already in that order.
+    """
+    if hasattr(X, 'columns') and features is not None:
+        missing = [f for f in features if f not in X.columns]
+        if missing:
+            raise ValueError(f"Feature frame is missing columns the model was trained on: {missing}")
+        X = X[features]
+    return np.ascontiguousarray(X.to_numpy(np.float32) if hasattr(X, 'to_numpy') else X, dtype=np.float32)
+
+
+def train_booster(params, X, y, n_threads, feature_names=None, n_rounds=ARM_ROUNDS, weight=None):
+    dtrain = xgb.QuantileDMatrix(X, label=y, weight=weight, feature_names=feature_names)
+    return xgb.train({**params, 'nthread': n_threads}, dtrain, num_boost_round=n_rounds)
+
+
+class UpliftLearner:
+    """
+    Shared interface: fit(X, y, t) with t the experiment arm (0 = Control, 1..K-1 = treatments),
+    and predict_lift(X) -> (n, K-1) matrix of P(y | arm k) - P(y | Control).
+    When the negatives were downsampled (see sampling.py), fit() takes the realized rate of each arm
+    and outcome probabilities are calibrated back to the full data before any lift is taken.
+    to_bundle() / from_bundle() convert to and from plain state + named boosters (see bundle.py).
+    Learners whose lift is a function of boosters scored on the plain feature matrix expose those
+    boosters via scoring_boosters() and the combination via lift_from_scores() (see compiled.py).
+    """
+    KIND = None
+
+    def __init__(self, n_arms=None, n_jobs=N_JOBS, params=None, n_rounds=None):
+        self.n_arms = n_arms or EXPERIMENT_CONFIG['n_variants']
+        self.n_jobs = n_jobs
+        self.params = params or ARM_PARAMS  # Outcome-model params (e.g. from tuning.py)
+        self.n_rounds = n_rounds or ARM_ROUNDS
+        self.negative_rates = None  # Per arm; None = trained on all rows
+        self.features = None
+
+    def _arm_masks(self, y, t):
+        t = np.asarray(t)
+        masks = [t == k for k in range(self.n_arms)]
+        for k, (name, mask) in enumerate(zip(variant_names(self.n_arms), masks)):
+            print(f"   Training {name} Model (T={k}) on {mask.sum()} samples...")
+            if len(np.unique(y[mask])) < 2:
+                print(f"   ️ Warning: {name} group has constant outcome. Model will predict constant.")
+        return masks
+
+    def _prepare(self, X, y, negative_rates=None):
+        self.features = list(X.columns) if hasattr(X, 'columns') else None
+        self.negative_rates = negative_rates
+        return as_matrix(X), np.asarray(y, dtype=np.float32)
+
+    def _calibrated(self, p):
+        """(K, n) sample-space arm probabilities -> full-data probabilities."""
+        if self.negative_rates is None:
+            return p
+        return np.stack([calibrate(p[k], r) for k, r in enumerate(self.negative_rates)])
+
+    def to_bundle(self):
+        return {'n_arms': self.n_arms, 'negative_rates': self.negative_rates}, self._named_boosters()
+
+    @classmethod
+    def from_bundle(cls, state, boosters):
+        learner = cls(n_arms=state['n_arms'])
+        learner.negative_rates = state.get('negative_rates')
+        learner._restore(state, boosters)
+        return learner
+
+    def scoring_boosters(self):
+        return None
+
+
+class TLearnerUplift(UpliftLearner):
+    """
+    T-Learner: one outcome model per arm.
+    Model 0: Predicts outcome given Control.
+    Model k: Predicts outcome given Treatment k.
+    Lift_k = Model k - Model 0
+    """
+    KIND = 't'
+
+    def __init__(self, n_arms=None, n_jobs=N_JOBS, params=None, n_rounds=None):
+        super().__init__(n_arms, n_jobs, params, n_rounds)
+        self.boosters = []
+
+    @classmethod
+    def from_boosters(cls, *boosters, negative_rates=None):
+        """Wraps arm boosters trained elsewhere (e.g. by train_joint.py) in the same learner."""
+        learner = cls(n_arms=len(boosters))
+        learner.negative_rates = negative_rates
+        learner.boosters = list(boosters)
+        learner.features = boosters[0].feature_names
+        return learner
+
+    def fit(self, X, y, t, negative_rates=None):
+        A, y = self._prepare(X, y, negative_rates)
+        masks = self._arm_masks(y, t)
+        self.boosters = run_arms(
+            [lambda n, m=m: train_booster(self.params, A[m], y[m], n, self.features, self.n_rounds) for m in masks],
+            [m.sum() for m in masks], self.n_jobs
+        )
+        return self
+
+    def _named_boosters(self):
+        return {f'arm_{k}': b for k, b in enumerate(self.boosters)}
+
+    def _restore(self, state, boosters):
+        self.boosters = [boosters[f'arm_{k}'] for k in range(self.n_arms)]
+        self.features = self.boosters[0].feature_names
+
+    def predict_arms(self, X):
+        """(K, n) outcome probabilities; every booster scores the same float32 matrix in place."""
+        A = as_matrix(X, self.features)
+        return self._calibrated(np.stack([b.inplace_predict(A) for b in self.boosters]))
+
+    def predict_lift(self, X):
+        p = self.predict_arms(X)
+        return (p[1:] - p[0]).T
+
+    def scoring_boosters(self):
+        return self._named_boosters()
+
+    def lift_from_scores(self, scores):
+        p = self._calibrated(np.stack([scores[f'arm_{k}'] for k in range(self.n_arms)]))
+        return (p[1:] - p[0]).T
+
+
+class SLearnerUplift(UpliftLearner):
+    """
+    S-Learner: a single outcome model on the features plus a one-hot arm indicator.
+    Counterfactuals for all K arms are scored in one predict over a stacked (K * n) matrix.
+    """
+    KIND = 's'
+
+    def __init__(self, n_arms=None, n_jobs=N_JOBS, params=None, n_rounds=None):
+        super().__init__(n_arms, n_jobs, params, n_rounds)
+        self.booster = None
+
+    def _with_arm(self, A, arms):
+        onehot = np.zeros((len(A), self.n_arms - 1), dtype=np.float32)
+        treated = arms > 0
+        onehot[np.flatnonzero(treated), arms[treated] - 1] = 1
+        return np.hstack([A, onehot])
+
+    def fit(self, X, y, t, negative_rates=None):
+        A, y = self._prepare(X, y, negative_rates)
+        self._arm_masks(y, t)
+        names = self.features and self.features + [f'arm_{k}' for k in range(1, self.n_arms)]
+        self.booster = train_booster(self.params, self._with_arm(A, np.asarray(t)), y, self.n_jobs, names,
+                                     self.n_rounds)
+        return self
+
+    def _named_boosters(self):
+        return {'model': self.booster}
+
+    def _restore(self, state, boosters):
+        self.booster = boosters['model']
+        names = self.booster.feature_names
+        self.features = names and names[:len(names) - (self.n_arms - 1)]
+
+    def predict_arms(self, X):
+        A = as_matrix(X, self.features)
+        n = len(A)
+        stacked = self._with_arm(np.tile(A, (self.n_arms, 1)), np.repeat(np.arange(self.n_arms), n))
+        return self._calibrated(self.booster.inplace_predict(stacked).reshape(self.n_arms, n))
+
+    def predict_lift(self, X):
+        p = self.predict_arms(X)
+        return (p[1:] - p[0]).T
+
+
+class XLearnerUplift(UpliftLearner):
+    """
+    X-Learner (Kunzel et al.), per treatment arm k against Control:
+    1. Outcome models mu_0 .. mu_{K-1} (a T-Learner).
+    2. Imputed effects: D = y - mu_0(x) on arm-k rows, D = mu_k(x) - y on control rows;
+       a regressor tau_k1 / tau_k0 is fit on each.
+    3. Lift_k = e_k * tau_k0 + (1 - e_k) * tau_k1, with e_k the arm-k share of {control, arm k}
+       (the propensity, constant in a randomized experiment).
+    """
+    KIND = 'x'
+
+    def __init__(self, n_arms=None, n_jobs=N_JOBS, params=None, n_rounds=None):
+        super().__init__(n_arms, n_jobs, params, n_rounds)
+        self.outcome = TLearnerUplift(n_arms, n_jobs, params, n_rounds)
+        self.effect_boosters = []  # [(tau_k0, tau_k1) for k in 1..K-1]
+        self.propensity = []
+
+    def fit(self, X, y, t, negative_rates=None):
+        # Reweighted effect regressions extrapolate badly onto the other group's rows, so the
+        # X-Learner is always trained on all rows (train_uplift.py falls back to rate 1.0)
+        if negative_rates is not None:
+            raise ValueError("The X-Learner does not support negative downsampling.")
+        A, y = self._prepare(X, y)
+        t = np.asarray(t)
+        self.outcome.fit(X, y, t)
+        mu = self.outcome.predict_arms(A)
+        masks = [t == k for k in range(self.n_arms)]
+
+        fits, sizes, self.propensity = [], [], []
+        for k in range(1, self.n_arms):
+            d0 = mu[k][masks[0]] - y[masks[0]]
+            d1 = y[masks[k]] - mu[0][masks[k]]
+            for m, d in ((masks[0], d0), (masks[k], d1)):
+                fits.append(lambda n, m=m, d=d: train_booster(EFFECT_PARAMS, A[m], d, n, self.features))
+                sizes.append(m.sum())
+            self.propensity.append(masks[k].sum() / max(masks[0].sum() + masks[k].sum(), 1))
+        print(f"   Training {len(fits)} imputed-effect models...")
+        boosters = run_arms(fits, sizes, self.n_jobs)
+        self.effect_boosters = list(zip(boosters[0::2], boosters[1::2]))
+        return self
+
+    def to_bundle(self):
+        state, boosters = super().to_bundle()
+        return {**state, 'propensity': [float(e) for e in self.propensity]}, boosters
+
+    def _named_boosters(self):
+        boosters = {f'mu_{k}': b for k, b in enumerate(self.outcome.boosters)}
+        for k, (tau0, tau1) in enumerate(self.effect_boosters, start=1):
+            boosters[f'tau_{k}_0'], boosters[f'tau_{k}_1'] = tau0, tau1
+        return boosters
+
+    def _restore(self, state, boosters):
+        self.outcome = TLearnerUplift.from_boosters(*[boosters[f'mu_{k}'] for k in range(self.n_arms)])
+        self.effect_boosters = [(boosters[f'tau_{k}_0'], boosters[f'tau_{k}_1']) for k in range(1, self.n_arms)]
+        self.propensity = state['propensity']
+        self.features = self.outcome.features
+
+    def scoring_boosters(self):
+        # Only the effect regressors are needed at prediction time
+        return {name: b for name, b in self._named_boosters().items() if name.startswith('tau_')}
+
+    def lift_from_scores(self, scores):
+        return np.column_stack([
+            e * scores[f'tau_{k}_0'] + (1 - e) * scores[f'tau_{k}_1']
+            for k, e in enumerate(self.propensity, start=1)
+        ])
+
+    def predict_lift(self, X):
+        A = as_matrix(X, self.features)
+        return self.lift_from_scores({name: b.inplace_predict(A) for name, b in self.scoring_boosters().items()})
+
+
+LEARNERS = {
+    't': TLearnerUplift,
+    's': SLearnerUplift,
+    'x': XLearnerUplift
+}
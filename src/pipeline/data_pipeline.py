@@ -1,14 +1,46 @@
 import pandas as pd
 import numpy as np
+import argparse
 import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.pipeline.incremental import load_state, save_state, reset_dataset, trim_parts, write_part
+from src.pipeline.sharding import split_by_shard, run_sharded
+from src.ab_testing.assignment import VariantAssigner
+from src.schema import EVENT_SCHEMA, IMPRESSION_SCHEMA, enforce_schema
 
 # CONFIGURATION
 RAW_EVENTS_PATH = "data/raw/events.csv"
-OUTPUT_PATH = "data/processed/impressions.parquet"
+RAW_EVENTS_DIR = "data/raw/events"  # Partitioned Parquet written by ingest_retailrocket.py
+OUTPUT_PATH = "data/processed/impressions.parquet"  # Dataset directory, one part per run
+STATE_PATH = "data/processed/_watermark.json"
 ATTRIBUTION_WINDOW = pd.Timedelta(minutes=60)
 
+# Outcome event -> label column, and how long after a view each outcome still counts
+OUTCOME_EVENTS = {
+    'click': 'clicked',
+    'addtocart': 'added_to_cart',
+    'transaction': 'purchased'
+}
+ATTRIBUTION_WINDOWS = {
+    'clicked': ATTRIBUTION_WINDOW,
+    'added_to_cart': ATTRIBUTION_WINDOW,
+    'purchased': ATTRIBUTION_WINDOW
+}
+
+
+def load_data(since=None):
+    """Loads raw events sorted by time, optionally only those strictly newer than `since`."""
+    # Prefer the ingested Parquet dataset: typed columns, no CSV re-parse
+    if os.path.isdir(RAW_EVENTS_DIR):
+        filters = None
+        if since is not None:
+            # Partition pruning on event_date, then an exact row filter on timestamp
+            filters = [('event_date', '>=', since.strftime('%Y-%m-%d')), ('timestamp', '>', since)]
+        df = pd.read_parquet(RAW_EVENTS_DIR, filters=filters).drop(columns=['event_date'], errors='ignore')
+        return enforce_schema(df, EVENT_SCHEMA).sort_values('timestamp', kind='stable')
 
-def load_data():
     if not os.path.exists(RAW_EVENTS_PATH):
         raise FileNotFoundError(f"File not found: {RAW_EVENTS_PATH}")
     df = pd.read_csv(RAW_EVENTS_PATH)
@@ -17,65 +49,134 @@ def load_data():
         df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
     else:
         df['timestamp'] = pd.to_datetime(df['timestamp'])
-    return df.sort_values('timestamp')
+    if since is not None:
+        df = df[df['timestamp'] > since]
+    return enforce_schema(df, EVENT_SCHEMA).sort_values('timestamp', kind='stable')
 
 
 def create_impressions(df):
     # Filter for views (impressions)
     impressions = df[df['event_type'] == 'view'].copy()
     impressions = impressions.rename(columns={'timestamp': 'impression_time'})
-    impressions['impression_id'] = (
-            impressions['user_id'].astype(str) + "_" +
-            impressions['item_id'].astype(str) + "_" +
-            impressions['impression_time'].astype(np.int64).astype(str)
-    )
+    # Fixed-width integer key: a stable 64-bit hash of (user, item, time) instead of string concatenation
+    impressions['impression_id'] = pd.util.hash_pandas_object(
+        impressions[['user_id', 'item_id', 'impression_time']], index=False
+    ).to_numpy().view(np.int64)
     # Initialize targets
-    for col in ['clicked', 'added_to_cart', 'purchased']:
-        impressions[col] = 0
+    for col in OUTCOME_EVENTS.values():
+        impressions[col] = np.int8(0)
     return impressions
 
 
-def attribute_events(impressions, all_events, event_type, target_col):
-    target_events = all_events[all_events['event_type'] == event_type].copy()
-    target_events = target_events.sort_values('timestamp')
+def attribute_outcomes(impressions, all_events, windows=None):
+    """
+    Labels every outcome in one pass.
+    All outcome events are matched to their latest prior view of the same (user, item)
+    with a single merge_asof at the widest window, then each outcome keeps only the
+    matches inside its own window. Both inputs must already be sorted by time (load_data() does this).
+    """
+    windows = {**ATTRIBUTION_WINDOWS, **(windows or {})}
+
+    outcomes = all_events.loc[
+        all_events['event_type'].isin(list(OUTCOME_EVENTS)), ['timestamp', 'user_id', 'item_id', 'event_type']
+    ]
+    views = impressions[['user_id', 'item_id', 'impression_time']].assign(_row=np.arange(len(impressions)))
 
     matched = pd.merge_asof(
-        target_events,
-        impressions[['impression_id', 'user_id', 'item_id', 'impression_time']],
+        outcomes,
+        views,
         left_on='timestamp',
         right_on='impression_time',
         by=['user_id', 'item_id'],
         direction='backward',
-        tolerance=ATTRIBUTION_WINDOW
+        tolerance=max(windows.values())
     )
-    successful_ids = matched['impression_id'].dropna().unique()
-    impressions.loc[impressions['impression_id'].isin(successful_ids), target_col] = 1
+    rows = matched['_row'].to_numpy()
+    lag = (matched['timestamp'] - matched['impression_time']).to_numpy()
+    event_type = matched['event_type'].to_numpy()
+
+    for event, target_col in OUTCOME_EVENTS.items():
+        hit = (event_type == event) & ~np.isnan(rows) & (lag <= windows[target_col].to_timedelta64())
+        labels = np.zeros(len(impressions), dtype=np.int8)
+        labels[rows[hit].astype(np.int64)] = 1
+        impressions[target_col] = labels
     return impressions
 
 
-def run_pipeline():
-    print("⏳ Running Pipeline...")
-    df = load_data()
+def build_impressions(df, windows, assigner=None):
+    """Views -> labeled, variant-assigned impressions for one frame (all events, or one user shard)."""
     impressions = create_impressions(df)
 
-    # Attribute outcomes
-    impressions = attribute_events(impressions, df, 'click', 'clicked')
-    impressions = attribute_events(impressions, df, 'addtocart', 'added_to_cart')
-    impressions = attribute_events(impressions, df, 'transaction', 'purchased')
+    # Attribute outcomes (click, add-to-cart, purchase) in a single pass
+    impressions = attribute_outcomes(impressions, df, windows)
 
     # Assign A/B Test Variant
-    print(" Assigning A/B Test Variants...")
-    np.random.seed(42)
-    # 50/50 Split: Control vs Treatment
-    impressions['variant'] = np.where(np.random.rand(len(impressions)) > 0.5, 'Treatment', 'Control')
+    # Per user, by hashing (experiment salt, user_id): serving reproduces it without a lookup table
+    impressions['variant'] = (assigner or VariantAssigner()).assign(impressions['user_id'].to_numpy())
 
     # Simple Feature: Hour of day (as a confounder example)
     impressions['hour_of_day'] = impressions['impression_time'].dt.hour
+    return enforce_schema(impressions, IMPRESSION_SCHEMA)
+
+
+def _build_shard(task):
+    # Worker: attribution is keyed by (user, item), so a user shard is self-contained
+    shard, df, windows, watermark = task
+    impressions = build_impressions(df, windows)
+    write_part(impressions, OUTPUT_PATH, watermark, shard=shard)
+    return len(impressions)
+
+
+def run_pipeline(windows=None, incremental=False, n_shards=1):
+    """
+    Full mode rebuilds the impressions dataset from all history.
+    Incremental mode only loads events newer than the persisted watermark minus the
+    widest attribution window: views in that trailing slice are re-opened (so late
+    clicks/purchases still attribute to them) and re-written together with the new ones.
+    With n_shards > 1, events are hash-partitioned by user_id and each shard is attributed
+    in its own process and written as its own part.
+    """
+    print("⏳ Running Pipeline...")
+    windows = {**ATTRIBUTION_WINDOWS, **(windows or {})}
+    state = load_state(STATE_PATH) if incremental else None
+
+    if state is None:
+        if incremental:
+            print("   No watermark found. Falling back to a full run.")
+        reopen_from = None
+        df = load_data()
+    else:
+        reopen_from = state['watermark'] - max(windows.values())
+        print(f"   Watermark: {state['watermark']}. Re-opening impressions after {reopen_from}.")
+        df = load_data(since=reopen_from)
+        if df.empty or df['timestamp'].max() <= state['watermark']:
+            print(" No new events since the last run.")
+            return
+
+    watermark = df['timestamp'].max()
+    if reopen_from is None:
+        reset_dataset(OUTPUT_PATH)
+    else:
+        trim_parts(OUTPUT_PATH, 'impression_time', reopen_from)
+
+    print(" Attributing Outcomes & Assigning A/B Test Variants...")
+    if n_shards > 1:
+        tasks = [(shard, events, windows, watermark) for shard, (events,) in enumerate(split_by_shard(df, n_shards))]
+        del df
+        n_rows = sum(run_sharded(_build_shard, tasks, n_shards))
+        target = f"{n_shards} shards in {OUTPUT_PATH}"
+    else:
+        impressions = build_impressions(df, windows)
+        n_rows = len(impressions)
+        target = write_part(impressions, OUTPUT_PATH, watermark)
 
-    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-    impressions.to_parquet(OUTPUT_PATH, index=False)
-    print(f" Saved {len(impressions):,} rows with 'variant' column to {OUTPUT_PATH}")
+    save_state(STATE_PATH, watermark=watermark)
+    print(f" Saved {n_rows:,} rows with 'variant' column to {target}")
 
 
 if __name__ == "__main__":
-    run_pipeline()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true', help="Only process events newer than the watermark")
+    parser.add_argument('--shards', type=int, default=1, help="Hash-partition by user_id and run shards in parallel")
+    args = parser.parse_args()
+    run_pipeline(incremental=args.incremental, n_shards=args.shards)
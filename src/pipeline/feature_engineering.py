@@ -1,50 +1,224 @@
 import pandas as pd
 import numpy as np
+import argparse
 import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.pipeline.incremental import load_state, save_state, reset_dataset, trim_parts, write_part
+from src.pipeline.data_pipeline import ATTRIBUTION_WINDOWS, STATE_PATH as PIPELINE_STATE_PATH
+from src.pipeline.state_store import CounterStore, group_rank
+from src.pipeline.sharding import split_by_shard, run_sharded
+from src.schema import IMPRESSION_SCHEMA, FEATURE_SCHEMA, enforce_schema
+from src.pipeline.window_features import (
+    POPULARITY_WINDOWS, RECENCY_CAP, item_window_features, user_window_features
+)
 
 INPUT_PATH = "data/processed/impressions.parquet"
-OUTPUT_PATH = "data/features/training_set.parquet"
+OUTPUT_PATH = "data/features/training_set.parquet"  # Dataset directory, one part per run
+STATE_PATH = "data/features/_watermark.json"
+
+# Cumulative counters kept in persistent per-entity stores: feature -> ID column
+# <feature>.npy holds values through the watermark (served online);
+# <feature>.checkpoint.npy excludes the trailing slice the next incremental run re-opens.
+STATE_DIR = "data/features/state"
+COUNTER_FEATURES = {
+    'user_view_count': 'user_id',
+    'item_global_views': 'item_id'
+}
+
+# Windowed conversions only count impressions whose purchase attribution has closed;
+# incremental runs load this much history before the re-opened slice as window context.
+CONVERSION_LAG = ATTRIBUTION_WINDOWS['purchased']
+CONTEXT_HORIZON = max(max(POPULARITY_WINDOWS.values()) + CONVERSION_LAG, RECENCY_CAP)
 
 
-def load_processed_data():
+def load_processed_data(since=None):
     if not os.path.exists(INPUT_PATH):
         raise FileNotFoundError(f"{INPUT_PATH} not found. Run pipeline/data_pipeline.py first.")
-    return pd.read_parquet(INPUT_PATH)
+    filters = [('impression_time', '>', since)] if since is not None else None
+    # Sharded runs write one part per user shard, so restore a global time order
+    # (ties broken by impression_id so sharded and single-process runs agree)
+    df = enforce_schema(pd.read_parquet(INPUT_PATH, filters=filters), IMPRESSION_SCHEMA)
+    return df.sort_values(['impression_time', 'impression_id'], kind='stable', ignore_index=True)
 
 
-def engineer_features(df):
-    print(" Engineering Features...")
+def load_counter_stores(checkpoint=False, mmap_mode=None):
+    suffix = '.checkpoint.npy' if checkpoint else '.npy'
+    return {
+        feature: CounterStore.load(os.path.join(STATE_DIR, feature + suffix), mmap_mode=mmap_mode)
+        for feature in COUNTER_FEATURES
+    }
+
+
+def save_counter_stores(stores, checkpoint=False):
+    suffix = '.checkpoint.npy' if checkpoint else '.npy'
+    for feature, store in stores.items():
+        store.save(os.path.join(STATE_DIR, feature + suffix))
+
+
+def counter_features(user_ids, item_ids, stores):
+    """Current counter features for serving, read from the same stores the batch step advances (NumPy only)."""
+    user_views = stores['user_view_count'].lookup(user_ids)
+    return {
+        'user_view_count': user_views.astype(FEATURE_SCHEMA['user_view_count']),
+        'item_global_views': stores['item_global_views'].lookup(item_ids).astype(FEATURE_SCHEMA['item_global_views']),
+        'user_item_log_views': np.log1p(user_views).astype(FEATURE_SCHEMA['user_item_log_views'])
+    }
+
+
+def add_item_features(df, item_store, n_context):
+    """Item-level features. These need every user's views of an item, so they run over the whole batch."""
+    # 1. Time-Windowed Item Popularity (views/conversions per window), context rows included
+    item_features = item_window_features(df, 'purchased', CONVERSION_LAG)
+
+    # 2. Item Popularity (All-time, windowed counts are in step 1)
+    # Global popularity so far (context rows were counted by earlier runs)
+    global_views = np.zeros(len(df), dtype=np.int64)
+    global_views[n_context:] = item_store.advance(df['item_id'].to_numpy()[n_context:])
+    item_features['item_global_views'] = global_views
+    return pd.concat([df, item_features], axis=1)
+
+
+def add_user_features(df, n_context, prior_views):
+    """
+    User-level features. These only need the user's own rows, so they can run per user shard.
+    `prior_views` is each non-context row's stored user view count before this batch.
+    """
+    # 1. Time-Windowed User Recency (session views, time since last view), then drop context
+    df = pd.concat([df, user_window_features(df)], axis=1)
+    df = df.iloc[n_context:].reset_index(drop=True)
+
+    # 2. User History Features
+    # (Assuming the dataframe is sorted by time)
+    df['user_view_count'] = prior_views + group_rank(df['user_id'].to_numpy())
+    return df
+
 
+def add_row_features(df):
     # 1. Temporal Features (Time of Day, Weekend)
     df['hour'] = df['impression_time'].dt.hour
     df['day_of_week'] = df['impression_time'].dt.dayofweek
     df['is_weekend'] = df['day_of_week'].isin([5, 6]).astype(int)
 
-    # 2. User History Features
-    # (Assuming the dataframe is sorted by time)
-    df['user_view_count'] = df.groupby('user_id').cumcount()
+    # 2. Interaction Features
+    df['user_item_log_views'] = np.log1p(df['user_view_count'])
 
-    # 3. Item Popularity (Rolling window simulation)
-    # Global popularity so far
-    df['item_global_views'] = df.groupby('item_id').cumcount()
+    # 3. Clean / Fill NAs (numeric columns only; categoricals like event_type have no 0 category)
+    num_cols = df.select_dtypes('number').columns
+    df[num_cols] = df[num_cols].fillna(0)
+    return enforce_schema(df, FEATURE_SCHEMA)
 
-    # 4. Interaction Features
-    df['user_item_log_views'] = np.log1p(df['user_view_count'])
 
-    # 5. Clean / Fill NAs
-    df = df.fillna(0)
+def engineer_features(df, stores=None, n_context=0):
+    """
+    `stores` optionally holds the persisted counter stores from earlier runs, so cumulative
+    counters continue from where the previous batch left off (they are advanced in place).
+    The first `n_context` rows are history only: they feed the sliding windows and are dropped.
+    """
+    print(" Engineering Features...")
+    if stores is None:
+        stores = {feature: CounterStore() for feature in COUNTER_FEATURES}
+
+    df = add_item_features(df, stores['item_global_views'], n_context)
+    user_ids = df['user_id'].to_numpy()[n_context:]
+    prior_views = stores['user_view_count'].lookup(user_ids)
+    stores['user_view_count'].increment(user_ids)
+    df = add_user_features(df, n_context, prior_views)
+    df = add_row_features(df)
 
     print(f" Generated {df.shape[1]} features.")
     return df
 
 
-def save_features(df):
-    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-    df.to_parquet(OUTPUT_PATH, index=False)
-    print(f" Saved features to {OUTPUT_PATH}")
+def _featurize_shard(task):
+    # Worker: user features for one user shard, written as that shard's part
+    shard, df, is_context, prior_views, watermark = task
+    n_context = int(is_context.sum())
+    df = add_row_features(add_user_features(df, n_context, prior_views[n_context:]))
+    write_part(df, OUTPUT_PATH, watermark, shard=shard)
+    return len(df)
+
+
+def engineer_features_sharded(df, stores, n_context, n_shards, watermark):
+    """
+    Parallel engineer_features(): item features (and the item counter) are reconciled over the
+    whole batch in this process, then rows are hash-partitioned by user_id and each shard's
+    user features run in a process pool and are written as a separate part.
+    """
+    print(f" Engineering Features across {n_shards} shards...")
+    df = add_item_features(df, stores['item_global_views'], n_context)
+
+    # Stored user counts are gathered here; workers only add their within-shard rank
+    user_ids = df['user_id'].to_numpy()
+    prior_views = np.zeros(len(df), dtype=np.int64)
+    prior_views[n_context:] = stores['user_view_count'].lookup(user_ids[n_context:])
+    stores['user_view_count'].increment(user_ids[n_context:])
+
+    is_context = np.arange(len(df)) < n_context
+    tasks = [
+        (shard, frame, context, prior, watermark)
+        for shard, (frame, context, prior) in enumerate(split_by_shard(df, n_shards, is_context, prior_views))
+    ]
+    del df
+    n_rows = sum(run_sharded(_featurize_shard, tasks, n_shards))
+    print(f" Saved {n_rows:,} featured rows as {n_shards} shards in {OUTPUT_PATH}")
+
+
+def save_features(df, watermark):
+    part = write_part(df, OUTPUT_PATH, watermark)
+    print(f" Saved features to {part}")
+
+
+def run_feature_engineering(incremental=False, n_shards=1):
+    """
+    Full mode re-features every impression. Incremental mode mirrors run_pipeline():
+    it re-opens the impressions whose labels may have changed since the last run
+    (the trailing attribution window) and appends them with the new ones as one part.
+    """
+    pipeline_state = load_state(PIPELINE_STATE_PATH)
+    state = load_state(STATE_PATH) if incremental else None
+
+    if state is None or pipeline_state is None:
+        if incremental:
+            print("   No watermark found. Falling back to a full run.")
+        df = load_processed_data()
+        stores = {feature: CounterStore() for feature in COUNTER_FEATURES}
+        n_context = 0
+        reset_dataset(OUTPUT_PATH)
+    else:
+        if pipeline_state['watermark'] <= state['watermark']:
+            print(" Features are up to date with the pipeline watermark.")
+            return
+        reopen_from = state['watermark'] - max(ATTRIBUTION_WINDOWS.values())
+        print(f"   Watermark: {state['watermark']}. Re-opening impressions after {reopen_from}.")
+        trim_parts(OUTPUT_PATH, 'impression_time', reopen_from)
+        stores = load_counter_stores(checkpoint=True)
+        df = load_processed_data(since=reopen_from - CONTEXT_HORIZON)
+        n_context = int((df['impression_time'] <= reopen_from).sum())
+
+    watermark = pipeline_state['watermark'] if pipeline_state is not None else df['impression_time'].max()
+    # Rows the next incremental run will re-open
+    live = df.iloc[n_context:]
+    tail_ids = live.loc[live['impression_time'] > watermark - max(ATTRIBUTION_WINDOWS.values()), ['user_id', 'item_id']]
+
+    if n_shards > 1:
+        engineer_features_sharded(df, stores, n_context, n_shards, watermark)
+    else:
+        save_features(engineer_features(df, stores, n_context), watermark)
+
+    # Persist counters: current values for serving, and a checkpoint without the
+    # rows the next incremental run will re-open (so they are not counted twice)
+    save_counter_stores(stores)
+    for feature, id_col in COUNTER_FEATURES.items():
+        stores[feature].retract(tail_ids[id_col].to_numpy())
+    save_counter_stores(stores, checkpoint=True)
+    save_state(STATE_PATH, watermark=watermark)
 
 
 if __name__ == "__main__":
-    df = load_processed_data()
-    df_features = engineer_features(df)
-    save_features(df_features)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true', help="Only process impressions newer than the watermark")
+    parser.add_argument('--shards', type=int, default=1, help="Hash-partition by user_id and run shards in parallel")
+    args = parser.parse_args()
+    run_feature_engineering(incremental=args.incremental, n_shards=args.shards)
@@ -0,0 +1,259 @@
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import shutil
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.pipeline.data_pipeline import ATTRIBUTION_WINDOWS
+from src.pipeline.feature_engineering import CONVERSION_LAG, OUTPUT_PATH, STATE_PATH
+from src.pipeline.incremental import load_state
+from src.pipeline.window_features import POPULARITY_WINDOWS, RECENCY_CAP, SESSION_GAP
+from src.schema import FEATURE_SCHEMA, enforce_schema, feature_columns
+
+# Online feature store: the latest feature values of every user and item, for serving.
+#   data/features/store/<version>/manifest.json           columns, sizes and the feature watermark
+#   data/features/store/<version>/<entity>.<column>.npy   float32, indexed by ID (NaN = never seen)
+#   data/features/store/<version>/user.last_view_*.npy    time (epoch seconds) and session views of each user's last view
+#   data/features/store/<version>/item.history_*.npy      sorted (item, time) keys of recent item views and conversions
+#   data/features/store/CURRENT                           name of the snapshot serving should map
+# A snapshot is never modified after CURRENT points at it. Serving processes memory-map the same
+# read-only files, so one copy of the pages is shared by every process on a node.
+# Stored values are those of each entity's latest feature row. Features relative to the request time
+# are not stored: context comes from the request time, user recency from it and the user's last view,
+# and windowed item counts from it and the item impressions of the last HISTORY before the watermark
+# (exact for request times at or after the watermark).
+STORE_DIR = "data/features/store"
+FORMAT_VERSION = 3
+KEEP_SNAPSHOTS = 2  # Processes still mapping the previous snapshot keep working until they refresh
+TIME_COL = 'impression_time'
+ENTITIES = {'user': 'user_id', 'item': 'item_id'}
+CONTEXT_FEATURES = ['hour_of_day', 'hour', 'day_of_week', 'is_weekend']  # Per request, from the request time
+RECENCY_FEATURES = ['user_session_views', 'user_secs_since_last_view']  # Per request, see FeatureStore.recency
+LAST_VIEW = ['last_view_time', 'last_view_session_views']  # User arrays the recency features are derived from
+ITEM_WINDOW_FEATURES = [f'item_{kind}_{suffix}' for kind in ('views', 'conversions') for suffix in POPULARITY_WINDOWS]
+HISTORY = max(POPULARITY_WINDOWS.values()) + CONVERSION_LAG  # Item impressions kept for ITEM_WINDOW_FEATURES
+
+
+def entity_columns(columns):
+    """Stored columns per entity: item_* features describe the item, the rest (bar per request ones) the user."""
+    per_request = CONTEXT_FEATURES + RECENCY_FEATURES + ITEM_WINDOW_FEATURES
+    features = [c for c in feature_columns(columns) if c not in per_request]
+    item = [c for c in features if c.startswith('item_')]
+    return {'user': [c for c in features if c not in item], 'item': item}
+
+
+def current_snapshot(store_dir=STORE_DIR):
+    path = os.path.join(store_dir, 'CURRENT')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip()
+
+
+def read_manifest(store_dir=STORE_DIR, version=None):
+    version = version or current_snapshot(store_dir)
+    if version is None:
+        return None
+    with open(os.path.join(store_dir, version, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def _column_path(store_dir, version, entity, col):
+    return os.path.join(store_dir, version, f"{entity}.{col}.npy")
+
+
+def build_feature_store(incremental=False, n_shards=None, store_dir=STORE_DIR):
+    """
+    Materializes the latest feature row of every user and item from the feature output into a new
+    snapshot and publishes it. Incremental runs start from the current snapshot and only read the
+    rows the feature step may have (re)written since: newer than its watermark minus the attribution
+    window (re-opened rows are re-featured with their final labels).
+    """
+    state = load_state(STATE_PATH)
+    if state is None:
+        raise FileNotFoundError(f" No feature run found ({STATE_PATH}). Run feature engineering first.")
+    manifest = read_manifest(store_dir) if incremental else None
+    if manifest is not None and manifest.get('format_version') != FORMAT_VERSION:
+        print(" Feature store format changed since the last snapshot. Rebuilding it from scratch...")
+        manifest = None
+    since = None
+    if manifest is not None:
+        if pd.Timestamp(manifest['watermark']) >= state['watermark']:
+            print(" Feature store is up to date with the feature watermark.")
+            return
+        since = pd.Timestamp(manifest['watermark']) - max(ATTRIBUTION_WINDOWS.values())
+
+    # 1. Feature rows to materialize (all of them, or the re-opened and new ones), in time order
+    print(f" Loading feature rows{f' after {since}' if since is not None else ''}...")
+    df = pd.read_parquet(OUTPUT_PATH, filters=[(TIME_COL, '>', since)] if since is not None else None)
+    df = enforce_schema(df, FEATURE_SCHEMA).sort_values(TIME_COL, kind='stable')
+    columns = entity_columns(df)
+    if manifest is not None and manifest['columns'] != columns:
+        print(" Feature columns changed since the last snapshot. Rebuilding it from scratch...")
+        return build_feature_store(False, n_shards, store_dir)
+
+    # 2. One dense array per column (float32; epoch seconds are float64), indexed by ID; the latest row of each entity wins
+    version = pd.Timestamp.now(tz='UTC').strftime('%Y%m%dT%H%M%S%f')
+    tmp_dir = os.path.join(store_dir, f".{version}.tmp")
+    os.makedirs(tmp_dir)
+    sizes = {}
+    for entity, id_col in ENTITIES.items():
+        latest = df.drop_duplicates(id_col, keep='last')
+        ids = latest[id_col].to_numpy(np.int64)
+        previous_size = manifest['sizes'][entity] if manifest is not None else 0
+        sizes[entity] = max(int(ids.max()) + 1 if len(ids) else 0, previous_size)
+        arrays = {col: latest[col].to_numpy(np.float32) for col in columns[entity]}
+        if entity == 'user':
+            arrays['last_view_time'] = latest[TIME_COL].to_numpy('datetime64[ns]').astype(np.int64) / 1e9
+            arrays['last_view_session_views'] = latest['user_session_views'].to_numpy(np.float32)
+        for col, latest_values in arrays.items():
+            values = np.full(sizes[entity], np.nan, dtype=latest_values.dtype)
+            if manifest is not None:
+                values[:previous_size] = np.load(_column_path(store_dir, manifest['version'], entity, col), mmap_mode='r')
+            values[ids] = latest_values
+            np.save(os.path.join(tmp_dir, f"{entity}.{col}.npy"), values)
+        print(f"   {entity}: {len(ids):,} updated, {sizes[entity]:,} ID slots, {len(columns[entity])} columns")
+
+    # 3. Item impressions of the last HISTORY as sorted item_id * stride + ms keys (rewritten every snapshot)
+    base = state['watermark'] - HISTORY
+    recent = pd.read_parquet(OUTPUT_PATH, columns=['item_id', TIME_COL, 'purchased'], filters=[(TIME_COL, '>=', base)])
+    stride = _ms(HISTORY) + 1
+    keys = (recent['item_id'].to_numpy(np.int64) * stride
+            + (recent[TIME_COL] - base).to_numpy() // np.timedelta64(1, 'ms'))
+    np.save(os.path.join(tmp_dir, 'item.history_views.npy'), np.sort(keys))
+    np.save(os.path.join(tmp_dir, 'item.history_conversions.npy'), np.sort(keys[recent['purchased'].to_numpy() > 0]))
+    print(f"   item history: {len(keys):,} impressions since {base}")
+
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump({'format_version': FORMAT_VERSION, 'version': version, 'watermark': state['watermark'].isoformat(),
+                   'columns': columns, 'sizes': sizes, 'history_base': base.isoformat(), 'history_ms': _ms(HISTORY)},
+                  f, indent=2)
+
+    # 4. Publish: move the finished snapshot in place, atomically repoint CURRENT, drop old snapshots
+    os.rename(tmp_dir, os.path.join(store_dir, version))
+    tmp_path = os.path.join(store_dir, 'CURRENT.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(store_dir, 'CURRENT'))
+    _prune(store_dir, keep=version)
+    print(f" Feature store snapshot {version} published (features through {state['watermark']}).")
+    return version
+
+
+def _ms(td):
+    return int(td // pd.Timedelta(milliseconds=1))
+
+
+def _prune(store_dir, keep):
+    snapshots = sorted(v for v in os.listdir(store_dir) if os.path.isdir(os.path.join(store_dir, v)))
+    for snapshot in snapshots[:-KEEP_SNAPSHOTS]:
+        if snapshot != keep:
+            # Unlinking is safe for processes that still map these files: their pages stay valid
+            shutil.rmtree(os.path.join(store_dir, snapshot), ignore_errors=True)
+
+
+class FeatureStore:
+    """
+    Read side: read-only memory maps of one snapshot's columns, gathered by ID array with NumPy
+    alone (no pandas, no Parquet decoding). refresh() swaps to a newer snapshot by replacing one
+    attribute, and every gather works on the snapshot it started with, so it never mixes two.
+    """
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self.snapshot = None
+        if not self.refresh():
+            raise FileNotFoundError(f" No feature store snapshot in {store_dir}. Run feature_store.py first.")
+
+    @property
+    def version(self):
+        return self.snapshot['version']
+
+    def refresh(self):
+        """Maps the CURRENT snapshot if it is newer than the mapped one. Returns whether it swapped."""
+        version = current_snapshot(self.store_dir)
+        if version is None or (self.snapshot is not None and version == self.snapshot['version']):
+            return False
+        manifest = read_manifest(self.store_dir, version)
+        if manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported feature store format {manifest.get('format_version')} "
+                             f"(expected {FORMAT_VERSION}). Rebuild it with feature_store.py.")
+        arrays = {
+            entity: {col: np.load(_column_path(self.store_dir, version, entity, col), mmap_mode='r') for col in cols}
+            for entity, cols in manifest['columns'].items()
+        }
+        last_view = {col: np.load(_column_path(self.store_dir, version, 'user', col), mmap_mode='r') for col in LAST_VIEW}
+        history = {kind: np.load(_column_path(self.store_dir, version, 'item', f'history_{kind}'), mmap_mode='r')
+                   for kind in ('views', 'conversions')}
+        history.update(base=pd.Timestamp(manifest['history_base']), stride=manifest['history_ms'] + 1)
+        self.snapshot = {'version': version, 'watermark': manifest['watermark'], 'sizes': manifest['sizes'],
+                         'arrays': arrays, 'last_view': last_view, 'history': history}
+        return True
+
+    def columns(self, entity):
+        return list(self.snapshot['arrays'][entity])
+
+    def gather(self, entity, ids, columns=None):
+        """(len(ids), len(columns)) float32 values by ID; NaN for IDs the snapshot has never seen."""
+        snapshot = self.snapshot
+        arrays = snapshot['arrays'][entity]
+        columns = list(arrays) if columns is None else columns
+        ids = np.asarray(ids, dtype=np.int64)
+        known = (ids >= 0) & (ids < snapshot['sizes'][entity])
+        rows = np.where(known, ids, 0)
+        out = np.empty((len(ids), len(columns)), dtype=np.float32)
+        for j, col in enumerate(columns):
+            out[:, j] = arrays[col][rows]
+        out[~known] = np.nan
+        return out
+
+    def recency(self, user_ids, now):
+        """
+        (len(user_ids), 2) RECENCY_FEATURES of a view at `now` (naive UTC), from each user's last view
+        (same definitions as window_features.user_window_features). Unseen users get a first view's values.
+        """
+        snapshot = self.snapshot
+        ids = np.asarray(user_ids, dtype=np.int64)
+        known = (ids >= 0) & (ids < snapshot['sizes']['user'])
+        rows = np.where(known, ids, 0)
+        last_time = np.where(known, snapshot['last_view']['last_view_time'][rows], np.nan)
+        cap = RECENCY_CAP.total_seconds()
+        gap = np.clip(pd.Timestamp(now).value / 1e9 - last_time, 0, cap)
+        gap[np.isnan(gap)] = cap
+
+        out = np.empty((len(ids), len(RECENCY_FEATURES)), dtype=np.float32)
+        same_session = gap <= SESSION_GAP.total_seconds()
+        out[:, 0] = np.where(same_session, snapshot['last_view']['last_view_session_views'][rows] + 1, 0)
+        out[:, 1] = gap
+        return out
+
+    def item_windows(self, item_ids, now):
+        """
+        (len(item_ids), 6) ITEM_WINDOW_FEATURES of an impression at `now` (naive UTC), counted over the
+        item's recent impressions like window_features.item_window_features: views in [now - w, now],
+        conversions of impressions in [now - lag - w, now - lag).
+        """
+        history = self.snapshot['history']
+        stride = history['stride']
+        origins = np.asarray(item_ids, dtype=np.int64) * stride  # Negative IDs match no key
+        t = _ms(pd.Timestamp(now) - history['base'])
+        out = np.empty((len(origins), len(ITEM_WINDOW_FEATURES)), dtype=np.float32)
+        lag = _ms(CONVERSION_LAG)
+        bounds = ([('views', t - _ms(width), t + 1) for width in POPULARITY_WINDOWS.values()]
+                  + [('conversions', t - lag - _ms(width), t - lag) for width in POPULARITY_WINDOWS.values()])
+        for j, (kind, lo, hi) in enumerate(bounds):
+            keys = history[kind]
+            lo, hi = min(max(lo, 0), stride), min(max(hi, 0), stride)
+            out[:, j] = np.searchsorted(keys, origins + hi) - np.searchsorted(keys, origins + lo)
+        return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true',
+                        help="Update the current snapshot with the feature rows written since it")
+    args = parser.parse_args()
+    build_feature_store(incremental=args.incremental)
@@ -0,0 +1,86 @@
+import pandas as pd
+import json
+import os
+import shutil
+
+# Incremental runs write one Parquet part per run (or per shard of a run) into a dataset
+# directory. Parts are named after the run's watermark, so lexical order == time order,
+# and every row of a run is newer than every row of the runs before it.
+PART_TEMPLATE = "part-{tag}.parquet"
+SHARD_PART_TEMPLATE = "part-{tag}-s{shard:03d}.parquet"
+
+
+def load_state(path):
+    """Returns the persisted watermark state, or None if there has been no run yet."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    return {k: pd.Timestamp(v) if v is not None else None for k, v in state.items()}
+
+
+def save_state(path, **state):
+    """Atomically persists the watermark state (write to a temp file, then rename)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({k: v.isoformat() if v is not None else None for k, v in state.items()}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def reset_dataset(path):
+    """Clears a dataset path for a full rebuild (also removes a legacy single-file output)."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    os.makedirs(path)
+
+
+def list_parts(path):
+    if not os.path.isdir(path):
+        return []
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.parquet'))
+
+
+def _run_tag(part):
+    # part-<tag>.parquet or part-<tag>-s<shard>.parquet -> <tag>
+    return os.path.basename(part)[len('part-'):].split('.')[0].split('-')[0]
+
+
+def trim_parts(path, time_col, boundary):
+    """
+    Re-opens the trailing slice of a dataset: drops every row with time_col > boundary.
+    Walks runs newest-first and stops at the first run whose parts all lie at or before
+    the boundary, so only the last few (small) parts are ever touched.
+    """
+    parts = list_parts(path)
+    for tag in sorted({_run_tag(p) for p in parts}, reverse=True):
+        touched = False
+        for part in [p for p in parts if _run_tag(p) == tag]:
+            times = pd.read_parquet(part, columns=[time_col])[time_col]
+            if times.empty or times.max() <= boundary:
+                continue
+            touched = True
+            kept = pd.read_parquet(part)
+            kept = kept[kept[time_col] <= boundary]
+            if kept.empty:
+                os.remove(part)
+            else:
+                kept.to_parquet(part, index=False)
+        if not touched:
+            break
+
+
+def part_path(path, watermark, shard=None):
+    tag = watermark.strftime('%Y%m%dT%H%M%S%f')
+    if shard is None:
+        return os.path.join(path, PART_TEMPLATE.format(tag=tag))
+    return os.path.join(path, SHARD_PART_TEMPLATE.format(tag=tag, shard=shard))
+
+
+def write_part(df, path, watermark, shard=None):
+    os.makedirs(path, exist_ok=True)
+    part = part_path(path, watermark, shard)
+    df.to_parquet(part, index=False)
+    return part
@@ -1,65 +1,100 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
+import shutil
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.schema import EVENT_TYPES, EVENT_SCHEMA, enforce_schema
 
 # CONFIG
 RAW_INPUT_PATH = "data/raw/retailrocket_events.csv"
 CANONICAL_OUTPUT_PATH = "data/raw/events.csv"
+CANONICAL_PARQUET_DIR = "data/raw/events"  # Date-partitioned Parquet (event_date=YYYY-MM-DD/)
+CHUNK_SIZE = 1_000_000  # Rows per streamed chunk; bounds peak memory
 
+RAW_COLUMNS = {
+    'visitorid': 'user_id',
+    'itemid': 'item_id',
+    'event': 'event_type',
+    'transactionid': 'transaction_id'
+}
 
-def ingest_retailrocket():
-    print(f" Starting Ingestion from {RAW_INPUT_PATH}...")
 
-    if not os.path.exists(RAW_INPUT_PATH):
-        raise FileNotFoundError(f" Could not find {RAW_INPUT_PATH}. Did you download it from Kaggle?")
+def standardize_chunk(chunk):
+    """Schema mapping, event-name mapping and null-key drops for one chunk of raw rows."""
+    # 1. Standardize Schema (The Adapter Step)
+    chunk = chunk.rename(columns=RAW_COLUMNS)
 
-    # 1. Load Data
+    # 2. Standardize Timestamps
     # RetailRocket timestamps are in Unix Milliseconds
-    df = pd.read_csv(RAW_INPUT_PATH)
-    print(f"   Loaded {len(df):,} raw rows.")
-
-    # 2. Standardize Schema (The Adapter Step)
-    print(" Adapting Schema...")
-    df = df.rename(columns={
-        'visitorid': 'user_id',
-        'itemid': 'item_id',
-        'event': 'event_type',
-        'transactionid': 'transaction_id'
-    })
-
-    # 3. Standardize Timestamps
-    # Convert ms integer to datetime object
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-
-    # 4. Standardize Event Names
-    # RetailRocket uses 'view', 'addtocart', 'transaction'
-    # Your synthetic data used 'view', 'click', 'addtocart', 'purchase'
-    # We need to map them to what your Feature Engineering expects
-    event_map = {
-        'view': 'view',
-        'addtocart': 'addtocart',
-        'transaction': 'transaction'  # We can treat this as 'purchase' or keep as 'transaction'
-    }
+    chunk['timestamp'] = pd.to_datetime(chunk['timestamp'], unit='ms')
+
+    # 3. Standardize Event Names
+    # RetailRocket uses 'view', 'addtocart', 'transaction'; EVENT_TYPES also has the synthetic 'click'
     # Note: RetailRocket has no explicit "click" event (View is the proxy for click usually)
-    # We will trust the raw names but ensure they are lowercase
-    df['event_type'] = df['event_type'].map(event_map)
-
-    # 5. Data Quality Checks (Simple)
-    print(" Running Quality Checks...")
-    # Drop rows with missing critical IDs
-    original_len = len(df)
-    df = df.dropna(subset=['user_id', 'item_id', 'timestamp'])
-    if len(df) < original_len:
-        print(f"   ️ Dropped {original_len - len(df)} rows with null keys.")
-
-    # 6. Sort by Time (Critical for sessionization)
-    df = df.sort_values('timestamp')
-
-    # 7. Save to Canonical Path
-    print(f" Saving Standardized Data to {CANONICAL_OUTPUT_PATH}...")
-    df.to_csv(CANONICAL_OUTPUT_PATH, index=False)
+    # Unknown names become NaN and are dropped with the null keys below
+    chunk['event_type'] = chunk['event_type'].str.lower().astype(EVENT_TYPES)
+
+    # 4. Drop rows with missing critical IDs
+    chunk = chunk.dropna(subset=['user_id', 'item_id', 'timestamp', 'event_type'])
+
+    # 5. Canonical compact dtypes (RetailRocket IDs fit comfortably in int32)
+    chunk = enforce_schema(chunk, EVENT_SCHEMA)
+
+    # 6. Sort by Time within the chunk (load_data() does the global sort)
+    return chunk.sort_values('timestamp', kind='stable')
+
+
+def write_partitioned(chunk, output_dir, part):
+    """Appends one standardized chunk to the date-partitioned Parquet dataset."""
+    chunk = chunk.assign(event_date=chunk['timestamp'].dt.strftime('%Y-%m-%d'))
+    table = pa.Table.from_pandas(chunk, preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=output_dir,
+        partition_cols=['event_date'],
+        basename_template=f"part-{part:05d}-{{i}}.parquet"
+    )
+
+
+def ingest_retailrocket(chunksize=CHUNK_SIZE):
+    print(f" Starting Streaming Ingestion from {RAW_INPUT_PATH}...")
+
+    if not os.path.exists(RAW_INPUT_PATH):
+        raise FileNotFoundError(f" Could not find {RAW_INPUT_PATH}. Did you download it from Kaggle?")
+
+    # Start from an empty dataset so re-runs don't duplicate parts
+    if os.path.exists(CANONICAL_PARQUET_DIR):
+        shutil.rmtree(CANONICAL_PARQUET_DIR)
+    os.makedirs(CANONICAL_PARQUET_DIR)
+
+    reader = pd.read_csv(
+        RAW_INPUT_PATH,
+        chunksize=chunksize,
+        dtype={'event': 'category', 'visitorid': np.float64, 'itemid': np.float64, 'transactionid': np.float64}
+    )
+
+    n_raw, n_kept = 0, 0
+    for part, chunk in enumerate(reader):
+        n_raw += len(chunk)
+        chunk = standardize_chunk(chunk)
+        n_kept += len(chunk)
+        write_partitioned(chunk, CANONICAL_PARQUET_DIR, part)
+        print(f"   Chunk {part}: {n_raw:,} rows read, {n_kept:,} kept.")
+
+    if n_kept < n_raw:
+        print(f"   ️ Dropped {n_raw - n_kept:,} rows with null keys or unknown events.")
+
+    # load_data() prefers the Parquet dataset; drop any stale CSV so data/raw/ has one source of truth
+    if os.path.exists(CANONICAL_OUTPUT_PATH):
+        os.remove(CANONICAL_OUTPUT_PATH)
+
+    print(f" Saved {n_kept:,} Standardized Events to {CANONICAL_PARQUET_DIR}/")
     print(" Ingestion Complete. The main pipeline is now ready to run.")
 
 
 if __name__ == "__main__":
-    ingest_retailrocket()
\ No newline at end of file
+    ingest_retailrocket()
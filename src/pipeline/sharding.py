@@ -0,0 +1,30 @@
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+def shard_of(user_ids, n_shards):
+    """Stable hash partition of user IDs into n_shards (same user -> same shard on every run)."""
+    return (pd.util.hash_array(np.asarray(user_ids, dtype=np.int64)) % np.uint64(n_shards)).astype(np.int64)
+
+
+def split_by_shard(df, n_shards, *arrays):
+    """
+    Hash-partitions the rows of df by user_id, keeping row (time) order within each shard.
+    Any extra per-row arrays are split the same way. Returns one tuple per shard.
+    """
+    shards = shard_of(df['user_id'].to_numpy(), n_shards)
+    order = np.argsort(shards, kind='stable')
+    bounds = np.searchsorted(shards[order], np.arange(n_shards + 1))
+    return [
+        (df.iloc[order[lo:hi]].reset_index(drop=True),) + tuple(a[order[lo:hi]] for a in arrays)
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def run_sharded(func, tasks, n_workers):
+    """Runs func over per-shard tasks in a process pool (in-process when there is one worker)."""
+    if n_workers <= 1:
+        return [func(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(func, tasks))
@@ -0,0 +1,81 @@
+import numpy as np
+import os
+
+
+class CounterStore:
+    """
+    Cumulative per-entity counters in a flat int64 array indexed by entity ID.
+    Persisted as a .npy file: the feature step loads it, advances it over each new
+    batch and saves it back; serving memory-maps the same file to read current values.
+    IDs must be non-negative integers (the canonical schema guarantees this).
+    """
+
+    def __init__(self, counts=None):
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else counts
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Loads a saved store (empty if missing). Use mmap_mode='r' for read-only serving."""
+        if not os.path.exists(path):
+            return cls()
+        return cls(np.load(path, mmap_mode=mmap_mode))
+
+    def save(self, path):
+        # Write-then-rename so readers never see a half-written array
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(self.counts))
+        os.replace(tmp_path, path)
+
+    def _grow(self, max_id):
+        if max_id >= len(self.counts):
+            grown = np.zeros(max(max_id + 1, 2 * len(self.counts)), dtype=np.int64)
+            grown[:len(self.counts)] = self.counts
+            self.counts = grown
+
+    def lookup(self, ids):
+        """Current counts for an array of IDs (0 for IDs never seen)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        out = np.zeros(len(ids), dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self.counts))
+        out[known] = self.counts[ids[known]]
+        return out
+
+    def increment(self, ids):
+        """Adds one to the count of every row's ID."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids):
+            self._grow(int(ids.max()))
+            self.counts += np.bincount(ids, minlength=len(self.counts))
+
+    def advance(self, ids):
+        """
+        Counts each row's ID over a time-ordered batch.
+        Returns, per row, how many times its ID was seen before it (stored count +
+        earlier rows in the batch), i.e. groupby().cumcount() continued across batches.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        prior = self.lookup(ids) + group_rank(ids)
+        self.increment(ids)
+        return prior
+
+    def retract(self, ids):
+        """Undoes advance() for rows counted in this run (e.g. a slice that will be re-opened)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids):
+            self.counts[:ids.max() + 1] -= np.bincount(ids)
+
+
+def group_rank(ids):
+    """Rank of each row within its ID group, in row order (a numpy groupby().cumcount())."""
+    ids = np.asarray(ids)
+    if len(ids) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Stable sort keeps row (time) order inside a group
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    is_start = np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]
+    group_start = np.maximum.accumulate(np.where(is_start, np.arange(len(ids)), 0))
+    rank = np.empty(len(ids), dtype=np.int64)
+    rank[order] = np.arange(len(ids)) - group_start
+    return rank
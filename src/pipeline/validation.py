@@ -1,48 +1,237 @@
 import pandas as pd
 import numpy as np
+import pyarrow.dataset as ds
 import os
+import sys
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from src.config import EXPERIMENT_CONFIG
 
-def validate_data(df):
+REQUIRED_COLS = ['user_id', 'item_id', 'timestamp', 'event_type']
+CHUNK_SIZE = 1_000_000  # Rows per CSV chunk / Parquet record batch
+BALANCE_TOLERANCE = 0.1  # Max deviation of the control share from its configured traffic weight
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter (~0.8% standard error at p=14) in 2^p one-byte registers.
+    Sketches of different chunks or shards merge by taking the register-wise maximum.
+    """
+
+    def __init__(self, p=14):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def add(self, values):
+        values = np.asarray(values)
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_array(values)
+        idx = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        # Rank = position of the leftmost 1-bit in the remaining (64 - p) bits;
+        # frexp is exact here because rest < 2^53
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        rank = (64 - self.p - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other):
+        merged = HyperLogLog(self.p)
+        merged.registers = np.maximum(self.registers, other.registers)
+        return merged
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        n_zero = np.count_nonzero(self.registers == 0)
+        if raw <= 2.5 * m and n_zero:
+            return int(round(m * np.log(m / n_zero)))  # Linear counting for small cardinalities
+        return int(round(raw))
+
+
+class ValidationStats:
+    """
+    Single-pass, mergeable summary of an event stream. update() folds in one chunk;
+    merge() combines the stats of consecutive chunks or of independent shards.
+    """
+
+    def __init__(self):
+        self.n_rows = 0
+        self.columns = None
+        self.null_counts = {col: 0 for col in REQUIRED_COLS}
+        self.event_counts = {}
+        self.variant_counts = {}
+        self.min_time = None
+        self.max_time = None
+        self.first_time = None
+        self.last_time = None
+        self.n_out_of_order = 0
+        self.users = HyperLogLog()
+        self.items = HyperLogLog()
+
+    def update(self, chunk):
+        cols = set(chunk.columns)
+        self.columns = cols if self.columns is None else self.columns & cols
+        self.n_rows += len(chunk)
+        if len(chunk) == 0:
+            return self
+
+        for col in REQUIRED_COLS:
+            if col in cols:
+                self.null_counts[col] += int(chunk[col].isna().sum())
+
+        if 'event_type' in cols:
+            _add_counts(self.event_counts, chunk['event_type'])
+        if 'variant' in cols:
+            _add_counts(self.variant_counts, chunk['variant'])
+
+        if 'timestamp' in cols:
+            ts = pd.to_datetime(chunk['timestamp'], unit='ms' if pd.api.types.is_numeric_dtype(chunk['timestamp']) else None)
+            values = ts.to_numpy()
+            valid = values[~np.isnat(values)]
+            if len(valid):
+                self._fold_times(valid.min(), valid.max(), valid[0], valid[-1],
+                                 int(np.count_nonzero(valid[1:] < valid[:-1])))
+
+        if 'user_id' in cols:
+            self.users.add(chunk['user_id'].dropna().to_numpy())
+        if 'item_id' in cols:
+            self.items.add(chunk['item_id'].dropna().to_numpy())
+        return self
+
+    def _fold_times(self, lo, hi, first, last, n_out_of_order):
+        # Folds in a later chunk's time range; the boundary between chunks counts too
+        if self.last_time is not None and first < self.last_time:
+            n_out_of_order += 1
+        self.n_out_of_order += n_out_of_order
+        self.min_time = lo if self.min_time is None else min(self.min_time, lo)
+        self.max_time = hi if self.max_time is None else max(self.max_time, hi)
+        self.first_time = first if self.first_time is None else self.first_time
+        self.last_time = last
+
+    def merge(self, other):
+        """Combines with the stats of the chunk/shard that follows this one."""
+        merged = ValidationStats()
+        merged.n_rows = self.n_rows + other.n_rows
+        if self.columns is None or other.columns is None:
+            merged.columns = self.columns if other.columns is None else other.columns
+        else:
+            merged.columns = self.columns & other.columns
+        merged.null_counts = {col: self.null_counts[col] + other.null_counts[col] for col in REQUIRED_COLS}
+        merged.event_counts = dict(self.event_counts)
+        _merge_counts(merged.event_counts, other.event_counts)
+        merged.variant_counts = dict(self.variant_counts)
+        _merge_counts(merged.variant_counts, other.variant_counts)
+        merged.users = self.users.merge(other.users)
+        merged.items = self.items.merge(other.items)
+        for stats in (self, other):
+            if stats.first_time is not None:
+                merged._fold_times(stats.min_time, stats.max_time, stats.first_time, stats.last_time,
+                                   stats.n_out_of_order)
+        return merged
+
+    def report(self):
+        return {
+            'n_rows': self.n_rows,
+            'missing_columns': [c for c in REQUIRED_COLS if self.columns is None or c not in self.columns],
+            'null_counts': {c: n for c, n in self.null_counts.items() if n},
+            'event_counts': dict(self.event_counts),
+            'variant_share': {v: n / sum(self.variant_counts.values()) for v, n in self.variant_counts.items()},
+            'time_range': (pd.Timestamp(self.min_time), pd.Timestamp(self.max_time)),
+            'n_out_of_order': self.n_out_of_order,
+            'approx_distinct_users': self.users.estimate(),
+            'approx_distinct_items': self.items.estimate()
+        }
+
+
+def _add_counts(counts, values):
+    for key, n in values.value_counts().items():
+        if n:
+            counts[str(key)] = counts.get(str(key), 0) + int(n)
+
+
+def _merge_counts(counts, other):
+    for key, n in other.items():
+        counts[key] = counts.get(key, 0) + n
+
+
+def iter_chunks(path, chunksize=CHUNK_SIZE):
+    """Streams a CSV file in chunks, or a Parquet file/dataset directory in record batches."""
+    if path.endswith('.csv'):
+        yield from pd.read_csv(path, chunksize=chunksize)
+    else:
+        for batch in ds.dataset(path, format='parquet', partitioning='hive').to_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+
+
+def collect_stats(path, chunksize=CHUNK_SIZE):
+    stats = ValidationStats()
+    for chunk in iter_chunks(path, chunksize):
+        stats.update(chunk)
+    return stats
+
+
+def check_stats(stats):
     print("  Running Data Validation Checks...")
+    report = stats.report()
 
     # 1. Schema Check
-    required_cols = ['user_id', 'item_id', 'timestamp', 'event_type']
-    for col in required_cols:
-        if col not in df.columns:
-            raise ValueError(f" Missing required column: {col}")
+    for col in report['missing_columns']:
+        raise ValueError(f" Missing required column: {col}")
     print("    Schema check passed.")
 
     # 2. Null Check
-    null_counts = df[required_cols].isnull().sum()
-    if null_counts.any():
-        print(f"    Warning: Found nulls in critical columns:\n{null_counts[null_counts > 0]}")
+    if report['null_counts']:
+        print(f"    Warning: Found nulls in critical columns: {report['null_counts']}")
     else:
         print("    No nulls in critical columns.")
 
     # 3. Treatment Balance Check (if variant exists)
-    if 'variant' in df.columns:
-        balance = df['variant'].value_counts(normalize=True)
-        print(f"   ⚖️  Treatment Balance:\n{balance}")
-        if abs(balance['control'] - 0.5) > 0.1:
+    if report['variant_share']:
+        share = report['variant_share']
+        print(f"   ⚖️  Treatment Balance: {share}")
+        # Case-insensitive: the pipeline writes 'Control'
+        control = sum(v for k, v in share.items() if k.lower() == 'control')
+        weights = EXPERIMENT_CONFIG.get('traffic_weights') or [1.0] * EXPERIMENT_CONFIG['n_variants']
+        if abs(control - weights[0] / sum(weights)) > BALANCE_TOLERANCE:
             print("   ️  Warning: Significant treatment imbalance detected!")
         else:
             print("    Treatment groups are balanced.")
 
     # 4. Funnel Logic Check
     # Purchases should not exceed Views
-    n_views = len(df[df['event_type'] == 'view'])
-    n_purchases = len(df[df['event_type'] == 'transaction'])
+    n_views = report['event_counts'].get('view', 0)
+    n_purchases = report['event_counts'].get('transaction', 0)
     if n_purchases > n_views:
         raise ValueError(" Logic Error: More purchases than views!")
     print(f"    Funnel Logic valid (Views: {n_views}, Purchases: {n_purchases})")
 
+    # 5. Time Order & Cardinality
+    start, end = report['time_range']
+    print(f"    Time range: {start} -> {end} ({report['n_out_of_order']:,} out-of-order rows)")
+    print(f"    ~{report['approx_distinct_users']:,} users, ~{report['approx_distinct_items']:,} items "
+          f"over {report['n_rows']:,} rows")
+
     print("  Validation Complete.\n")
+    return report
+
+
+def validate_data(df):
+    """Validates an in-memory DataFrame (same checks as the streaming path)."""
+    return check_stats(ValidationStats().update(df))
+
+
+def validate_path(path, chunksize=CHUNK_SIZE):
+    """Validates a CSV file or Parquet dataset without loading it all into memory."""
+    return check_stats(collect_stats(path, chunksize))
 
 
 if __name__ == "__main__":
     # Test run
     DATA_PATH = "data/raw/events.csv"
-    if os.path.exists(DATA_PATH):
-        df = pd.read_csv(DATA_PATH)
-        validate_data(df)
\ No newline at end of file
+    PARQUET_DIR = "data/raw/events"  # Written by ingest_retailrocket.py
+    if os.path.isdir(PARQUET_DIR):
+        validate_path(PARQUET_DIR)
+    elif os.path.exists(DATA_PATH):
+        validate_path(DATA_PATH)
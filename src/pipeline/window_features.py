@@ -0,0 +1,100 @@
+import pandas as pd
+import numpy as np
+
+# Sliding windows for popularity features (feature name suffix -> width)
+POPULARITY_WINDOWS = {
+    '1h': pd.Timedelta(hours=1),
+    '24h': pd.Timedelta(hours=24),
+    '7d': pd.Timedelta(days=7)
+}
+SESSION_GAP = pd.Timedelta(minutes=30)  # Inactivity gap that starts a new session
+RECENCY_CAP = pd.Timedelta(days=7)  # "Time since last view" is capped (also used when there is none)
+
+_MS = np.int64(1_000_000)  # ns -> ms
+
+
+def _to_ms(td):
+    return np.int64(td.value // _MS)
+
+
+def group_time_order(ids, times, horizon):
+    """
+    Orders time-sorted rows by (group, time) with a single stable argsort on the IDs.
+    Each row then gets the key group_rank * stride + time_ms, where stride exceeds the time span
+    plus `horizon`, so a window [key - horizon, key] can never reach into another group.
+    Returns the (ascending) sorted keys, the sort order, and the sorted dense group ranks.
+    """
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    groups = np.zeros(len(ids), dtype=np.int64)
+    groups[1:] = np.cumsum(sorted_ids[1:] != sorted_ids[:-1])
+
+    t_ms = times.astype('datetime64[ms]').astype(np.int64)
+    t_ms = t_ms - t_ms.min() if len(t_ms) else t_ms
+    stride = np.int64(t_ms.max() if len(t_ms) else 0) + _to_ms(horizon) + 1
+    if len(groups) and (groups[-1] + 1) > np.iinfo(np.int64).max // stride:
+        raise ValueError("Too many groups for the time span to build int64 window keys.")
+
+    return groups * stride + t_ms[order], order, groups
+
+
+def window_sums(sorted_keys, width, lag=None, weights=None):
+    """
+    For each row (in sorted order): the number (or weighted sum) of rows of the same group
+    with time in [t - lag - width, t - lag). With no lag the window is every earlier row
+    with time >= t - width, matching cumcount semantics for same-timestamp ties.
+    """
+    lo = np.searchsorted(sorted_keys, sorted_keys - _to_ms((lag or pd.Timedelta(0)) + width), side='left')
+    if lag is None:
+        hi = np.arange(len(sorted_keys))
+    else:
+        hi = np.searchsorted(sorted_keys, sorted_keys - _to_ms(lag), side='left')
+    if weights is None:
+        return hi - lo
+    csum = np.concatenate([[0], np.cumsum(weights, dtype=np.int64)])
+    return csum[hi] - csum[lo]
+
+
+def item_window_features(df, conversion_col, conversion_lag):
+    """
+    Item views and conversions over each POPULARITY_WINDOWS width, before each impression.
+    Conversions are counted for impressions whose attribution window has already closed
+    (shifted back by `conversion_lag`), so the feature never peeks at future outcomes.
+    """
+    horizon = max(POPULARITY_WINDOWS.values()) + conversion_lag
+    keys, order, _ = group_time_order(df['item_id'].to_numpy(), df['impression_time'].to_numpy(), horizon)
+    conversions = df[conversion_col].to_numpy()[order]
+
+    features = {}
+    for suffix, width in POPULARITY_WINDOWS.items():
+        views = np.empty(len(df), dtype=np.int32)
+        views[order] = window_sums(keys, width)
+        features[f'item_views_{suffix}'] = views
+
+        converted = np.empty(len(df), dtype=np.int32)
+        converted[order] = window_sums(keys, width, lag=conversion_lag, weights=conversions)
+        features[f'item_conversions_{suffix}'] = converted
+    return pd.DataFrame(features, index=df.index)
+
+
+def user_window_features(df):
+    """Views so far in the user's current session and seconds since their previous view."""
+    keys, order, groups = group_time_order(df['user_id'].to_numpy(), df['impression_time'].to_numpy(), RECENCY_CAP)
+    pos = np.arange(len(df))
+
+    # Same-user predecessor and the gap to it (key differences are time differences within a group)
+    same_user = np.concatenate([[False], groups[1:] == groups[:-1]])
+    gap_ms = np.diff(keys, prepend=keys[:1])
+    gap_ms = np.where(same_user, np.minimum(gap_ms, _to_ms(RECENCY_CAP)), _to_ms(RECENCY_CAP))
+
+    new_session = ~same_user | (gap_ms > _to_ms(SESSION_GAP))
+    session_start = np.maximum.accumulate(np.where(new_session, pos, 0))
+
+    session_views = np.empty(len(df), dtype=np.int32)
+    session_views[order] = pos - session_start
+    secs_since_last = np.empty(len(df), dtype=np.float32)
+    secs_since_last[order] = gap_ms / 1000
+    return pd.DataFrame({
+        'user_session_views': session_views,
+        'user_secs_since_last_view': secs_since_last
+    }, index=df.index)
@@ -0,0 +1,293 @@
+import argparse
+import ast
+import hashlib
+import importlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+# CONFIG
+STATE_PATH = "data/_runner_state.json"  # Last successful fingerprint of every stage
+HASH_CACHE_PATH = "data/_hash_cache.json"  # (size, mtime) -> content digest, so unchanged files aren't re-read
+MAX_WORKERS = 2  # Independent stages (e.g. the two training jobs) run side by side
+
+# Stage -> entry point, the data it depends on, what it writes and which stages must run first.
+# A stage is skipped when its code, its config and the content of its inputs are all unchanged.
+# Its code is its entry module plus every src.* module it imports, transitively (see code_files).
+# 'config' names a function whose (JSON) result is part of the fingerprint, e.g. the tuned hyperparameters.
+# 'sampled' stages take the --negative-rate option, and a given rate is part of their fingerprint.
+# 'covers' lists stages whose outputs the stage rebuilds as well: a successful run records their
+# fingerprints too, so e.g. 'train_ranker --incremental' after 'make train' warm-starts the joint ranker.
+STAGES = {
+    'ingest': {
+        'func': ('src.pipeline.ingest_retailrocket', 'ingest_retailrocket'),
+        'inputs': ['data/raw/retailrocket_events.csv'],
+        'outputs': ['data/raw/events'],
+        'after': []
+    },
+    'pipeline': {
+        'func': ('src.pipeline.data_pipeline', 'run_pipeline'),
+        'inputs': ['data/raw/events', 'data/raw/events.csv'],
+        'outputs': ['data/processed/impressions.parquet'],
+        'after': [],
+        'incremental': True
+    },
+    'features': {
+        'func': ('src.pipeline.feature_engineering', 'run_feature_engineering'),
+        'inputs': ['data/processed/impressions.parquet'],
+        'outputs': ['data/features/training_set.parquet', 'data/features/state'],
+        'after': ['pipeline'],
+        'incremental': True
+    },
+    'feature_store': {
+        # Latest user/item feature vectors for serving; incremental runs update the current snapshot
+        'func': ('src.pipeline.feature_store', 'build_feature_store'),
+        'inputs': ['data/features/training_set.parquet'],
+        'outputs': ['data/features/store/CURRENT'],
+        'after': ['features'],
+        'incremental': True
+    },
+    'train_ranker': {
+        # Incremental runs warm-start the current ranker on the new feature rows only
+        'func': ('src.models.train_ranker', 'refresh_ranker'),
+        'inputs': ['data/features/training_set.parquet'],
+        'config': ('src.models.bundle', 'tuning_config'),
+        'outputs': ['models/bundle/CURRENT'],
+        'sampled': True,
+        'after': ['features'],
+        'incremental': True
+    },
+    'train_uplift': {
+        'func': ('src.models.train_uplift', 'train_uplift_model'),
+        'inputs': ['data/features/training_set.parquet'],
+        'config': ('src.models.bundle', 'tuning_config'),
+        'outputs': ['models/bundle/CURRENT'],
+        'sampled': True,
+        'after': ['features']
+    },
+    'train_joint': {
+        # Ranker + both uplift arms from one load and one quantization of the training set
+        'func': ('src.models.train_joint', 'train_joint'),
+        'inputs': ['data/features/training_set.parquet'],
+        'config': ('src.models.bundle', 'tuning_config'),
+        'outputs': ['models/bundle/CURRENT'],
+        'sampled': True,
+        'after': ['features'],
+        'covers': ['train_ranker', 'train_uplift']
+    },
+    'tune': {
+        # Hyperparameter search; writes the best configurations into the bundle (not part of 'all')
+        'func': ('src.models.tuning', 'tune'),
+        'inputs': ['data/features/training_set.parquet'],
+        'outputs': ['models/bundle/CURRENT'],
+        'after': ['features']
+    }
+}
+
+TARGETS = {
+    'all': ['train_joint', 'feature_store'],
+    'train': ['train_joint']
+}
+
+
+class HashCache:
+    """Content digests of files, re-computed only when a file's size or mtime changes."""
+
+    def __init__(self, path=HASH_CACHE_PATH):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        key = [stat.st_size, stat.st_mtime_ns]
+        cached = self.entries.get(path)
+        if cached and cached[:2] == key:
+            return cached[2]
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.entries[path] = key + [h.hexdigest()]
+        return h.hexdigest()
+
+    def digest(self, paths):
+        """One digest over files and directory trees (missing paths hash as missing)."""
+        h = hashlib.blake2b(digest_size=16)
+        for path in paths:
+            if os.path.isdir(path):
+                files = sorted(os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+            else:
+                files = [path] if os.path.exists(path) else []
+            h.update(f"{path}:{len(files)}".encode())
+            for file in files:
+                h.update(f"{os.path.relpath(file, path)}={self.file_digest(file)}".encode())
+        return h.hexdigest()
+
+    def save(self):
+        self.entries = {p: e for p, e in self.entries.items() if os.path.exists(p)}
+        _write_json(self.path, self.entries)
+
+
+def _write_json(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def code_files(module, found=None):
+    """Source files of `module` and of every src.* module it imports, transitively (sorted)."""
+    found = set() if found is None else found
+    path = _module_path(module)
+    if path is None or path in found:
+        return sorted(found)
+    found.add(path)
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            # `from src.models import train_ranker` imports the submodule when there is one
+            names = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+        else:
+            continue
+        for name in names:
+            if name.split('.')[0] == 'src':
+                code_files(name, found)
+    return sorted(found)
+
+
+def _module_path(module):
+    base = os.path.join(*module.split('.'))
+    for path in (f"{base}.py", os.path.join(base, '__init__.py')):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def fingerprint(name, hashes, negative_rate=None):
+    """
+    Code digest (the source of the stage's entry module and everything it imports from src, config
+    included; a change forces a full rebuild), input digest (the content of every file the stage reads), for stages with
+    a 'config' function a digest of its result, and for 'sampled' stages the negative rate given.
+    """
+    stage = STAGES[name]
+    fp = {
+        'code': hashes.digest(code_files(stage['func'][0])),
+        'inputs': hashes.digest(stage['inputs'])
+    }
+    if 'config' in stage:
+        module, func = stage['config']
+        config = json.dumps(getattr(importlib.import_module(module), func)(), sort_keys=True, default=str)
+        fp['config'] = hashlib.blake2b(config.encode(), digest_size=16).hexdigest()
+    if stage.get('sampled') and negative_rate is not None:
+        fp['negative_rate'] = negative_rate
+    return fp
+
+
+def resolve(targets):
+    """Requested stages plus everything upstream of them, in dependency order."""
+    ordered = []
+
+    def visit(name):
+        if name not in ordered:
+            for dep in STAGES[name]['after']:
+                visit(dep)
+            ordered.append(name)
+
+    for target in targets:
+        for name in TARGETS.get(target, [target]):
+            if name not in STAGES:
+                raise ValueError(f"Unknown stage '{name}'. Choose from {list(STAGES) + list(TARGETS)}.")
+            visit(name)
+    return ordered
+
+
+def _run_stage(name, kwargs):
+    module, func = STAGES[name]['func']
+    getattr(importlib.import_module(module), func)(**kwargs)
+
+
+def run(targets, force=False, incremental=False, n_shards=1, max_workers=MAX_WORKERS, negative_rate=None):
+    """
+    Runs the requested stages, skipping every stage whose fingerprint matches its last
+    successful run. Stages whose dependencies are done are dispatched concurrently.
+    `negative_rate` (None = each script's default) is passed to the 'sampled' training stages.
+    """
+    stages = resolve(targets)
+    state = {}
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH) as f:
+            state = json.load(f)
+    hashes = HashCache()
+    done, running = set(), {}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while len(done) < len(stages):
+            # 1. Dispatch (or skip) every stage whose dependencies have finished
+            progress = True
+            while progress:
+                progress = False
+                for name in stages:
+                    if name in done or name in {n for n, _ in running.values()}:
+                        continue
+                    if any(dep in stages and dep not in done for dep in STAGES[name]['after']):
+                        continue
+                    params = {'n_shards': n_shards} if STAGES[name].get('incremental') else {}
+                    if STAGES[name].get('sampled') and negative_rate is not None:
+                        params['negative_rate'] = negative_rate
+                    fp = fingerprint(name, hashes, negative_rate)
+                    last = state.get(name)
+                    outputs_exist = all(os.path.exists(p) for p in STAGES[name]['outputs'])
+                    if not force and last == fp and outputs_exist:
+                        print(f" [{name}] Up to date, skipping.")
+                        done.add(name)
+                        progress = True
+                        continue
+                    if STAGES[name].get('incremental'):
+                        # Only new inputs changed: catch up from the watermark. Code/config changed: rebuild.
+                        params['incremental'] = (incremental and not force and outputs_exist
+                                                 and last is not None and last['code'] == fp['code']
+                                                 and last.get('config') == fp.get('config')
+                                                 and last.get('negative_rate') == fp.get('negative_rate'))
+                    print(f" [{name}] Running ({', '.join(f'{k}={v}' for k, v in params.items()) or 'full'})...")
+                    fps = {name: fp, **{c: fingerprint(c, hashes, negative_rate) for c in STAGES[name].get('covers', [])}}
+                    running[pool.submit(_run_stage, name, params)] = (name, fps)
+
+            hashes.save()
+            if not running:
+                break
+
+            # 2. Record each finished stage; its outputs are the next stage's inputs
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, fps = running.pop(future)
+                future.result()
+                state.update(fps)
+                _write_json(STATE_PATH, state)
+                done.add(name)
+                print(f" [{name}] Done.")
+
+    hashes.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('targets', nargs='+', help=f"Stages ({', '.join(STAGES)}) or groups ({', '.join(TARGETS)})")
+    parser.add_argument('--force', action='store_true', help="Re-run every selected stage from scratch")
+    parser.add_argument('--incremental', action='store_true', help="Catch up from the watermark when only inputs changed")
+    parser.add_argument('--shards', type=int, default=1, help="Hash-partition the pipeline stages by user_id")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help="Max stages running at once")
+    parser.add_argument('--negative-rate', type=float, default=None,
+                        help="Share of negative rows the training stages keep (default: sampling.NEGATIVE_RATE)")
+    args = parser.parse_args()
+    run(args.targets, force=args.force, incremental=args.incremental, n_shards=args.shards, max_workers=args.workers,
+        negative_rate=args.negative_rate)
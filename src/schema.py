@@ -0,0 +1,76 @@
+import pandas as pd
+import numpy as np
+
+from src.config import DROP_COLS, EXPERIMENT_CONFIG
+from src.ab_testing.assignment import variant_names
+
+# Canonical, compact dtypes shared by every stage (ingest -> pipeline -> features -> models -> serving).
+# Strings repeated on every row are categoricals, labels/flags are int8, IDs are one fixed-width int.
+
+EVENT_TYPES = pd.CategoricalDtype(['view', 'click', 'addtocart', 'transaction'])
+VARIANTS = pd.CategoricalDtype(variant_names(EXPERIMENT_CONFIG['n_variants']))
+
+ID = 'id'  # Marker for ID columns, stored as ID_DTYPE
+ID_DTYPE = np.int32  # One width for every part of every dataset; int64 if a dataset's IDs exceed 2**31 - 1
+IMPRESSION_KEY = np.int64  # Fixed-width 64-bit hash of (user, item, time)
+
+EVENT_SCHEMA = {
+    'timestamp': 'datetime64[ns]',
+    'user_id': ID,
+    'item_id': ID,
+    'event_type': EVENT_TYPES,
+    'transaction_id': 'Int32'
+}
+
+IMPRESSION_SCHEMA = {
+    'impression_time': 'datetime64[ns]',
+    'user_id': ID,
+    'item_id': ID,
+    'event_type': EVENT_TYPES,
+    'transaction_id': 'Int32',
+    'impression_id': IMPRESSION_KEY,
+    'clicked': np.int8,
+    'added_to_cart': np.int8,
+    'purchased': np.int8,
+    'variant': VARIANTS,
+    'hour_of_day': np.int8
+}
+
+FEATURE_SCHEMA = {
+    **IMPRESSION_SCHEMA,
+    'is_treated': np.int8,
+    'hour': np.int8,
+    'day_of_week': np.int8,
+    'is_weekend': np.int8,
+    'user_view_count': np.int32,
+    'item_global_views': np.int32,
+    'user_item_log_views': np.float32,
+    **{f'item_{kind}_{window}': np.int32 for kind in ('views', 'conversions') for window in ('1h', '24h', '7d')},
+    'user_session_views': np.int32,
+    'user_secs_since_last_view': np.float32
+}
+
+
+def _check_ids(values, col):
+    info = np.iinfo(ID_DTYPE)
+    if len(values) and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(f"{col} has values outside {np.dtype(ID_DTYPE).name}: widen schema.ID_DTYPE for this dataset.")
+
+
+def enforce_schema(df, schema):
+    """Casts every column of df that appears in `schema` to its canonical dtype (returns df)."""
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype is ID:
+            dtype = ID_DTYPE
+            if df[col].dtype != dtype:
+                _check_ids(df[col], col)
+        if df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def feature_columns(df):
+    """Model inputs: every column (of a frame, or a list of names) that is not an ID, label, leak or treatment column."""
+    return [c for c in getattr(df, 'columns', df) if c not in DROP_COLS]
@@ -0,0 +1,90 @@
+import sys
+import time
+from collections import OrderedDict
+
+# CONFIG
+MAX_ENTRIES = 1_000_000
+MAX_BYTES = 256 * 1024 ** 2  # Estimated size of keys + scores + dict overhead
+TTL_SECONDS = 300  # Scores older than this are recomputed even if both versions are unchanged
+ENTRY_OVERHEAD = 100  # Bytes per entry for the ordered dict's hash slot and linked-list node
+
+
+class ScoreCache:
+    """
+    In-process LRU cache of scores with a TTL, bounded by entry count and estimated memory.
+    Keys are (user_id, item_id, feature version, bundle version, request time bucket, supplied
+    features): a new feature snapshot, model bundle or time bucket changes every key, and the stale
+    entries age out through LRU eviction and the TTL.
+    Popular (user, item) pairs re-scored within minutes are served without touching the models.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl_seconds=TTL_SECONDS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (expires_at, scores, size); least recently used first
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # Dropped to stay within max_entries / max_bytes
+        self.expirations = 0  # Dropped because their TTL ran out
+
+    @classmethod
+    def _size(cls, key, scores):
+        return cls._deep_size(key) + cls._deep_size(scores) + ENTRY_OVERHEAD
+
+    @classmethod
+    def _deep_size(cls, obj):
+        # Keys nest tuples (the supplied (feature, value) pairs); shared small objects are counted anyway
+        if isinstance(obj, tuple):
+            return sys.getsizeof(obj) + sum(cls._deep_size(o) for o in obj)
+        return sys.getsizeof(obj)
+
+    def get_many(self, keys):
+        """Cached scores per key (None for misses and expired entries); hits become most recently used."""
+        now = self.clock()
+        out = []
+        for key in keys:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                out.append(None)
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                out.append(entry[1])
+        return out
+
+    def put_many(self, keys, scores):
+        """Stores one tuple of scores per key, then evicts least recently used entries over the bounds."""
+        expires_at = self.clock() + self.ttl
+        for key, value in zip(keys, scores):
+            value = tuple(value)
+            if key in self.entries:
+                self._drop(key)
+            size = self._size(key, value)
+            self.entries[key] = (expires_at, value, size)
+            self.n_bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.n_bytes > self.max_bytes):
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _drop(self, key):
+        self.n_bytes -= self.entries.pop(key)[2]
+
+    def clear(self):
+        self.entries.clear()
+        self.n_bytes = 0
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.n_bytes, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate, 'evictions': self.evictions, 'expirations': self.expirations}
@@ -0,0 +1,388 @@
+import asyncio
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from src.inference import FEATURE_DATA_PATH, RecommendationServingEngine
+from src.schema import FEATURE_SCHEMA, enforce_schema, feature_columns
+from src.score_cache import ScoreCache
+
+# CONFIG
+HOST = "127.0.0.1"
+PORT = 8765
+MAX_BATCH_ROWS = 256  # A micro-batch is scored before it would exceed this many rows (inference.COMPILED_MAX_ROWS)...
+MAX_WAIT_MS = 5  # ...or this long after its first request arrived, whichever comes first
+MAX_IN_FLIGHT = 1024  # File mode: requests submitted ahead of the oldest unanswered one
+REQUESTS_PATH = "data/serving/requests.jsonl"
+RESULTS_PATH = "data/serving/results.jsonl"
+ROWS_PER_REQUEST = 10  # Candidate items per request in sampled requests
+REFRESH_SECONDS = 30  # How often a server checks for a new feature store snapshot
+ZIPF_EXPONENT = 1.2  # Sampled traffic: popularity skew of repeated requests (0 = every request distinct)
+CACHE_BUCKET_SECONDS = 60  # Score cache: scores are reused within one bucket of request time (divides an hour)
+SCORE_COLS = ['predicted_ctr', 'predicted_uplift', 'final_score']
+
+# Wire format (one JSON object per line, in both directions):
+#   request:  {"request_id": ..., "user_id": 42, "rows": [{"item_id": 7, "<feature>": value, ...}, ...]}
+#   response: {"request_id": ..., "user_id": 42, "items": [{"item_id": 7, "predicted_ctr": ..., ...}, ...]}
+# Response items are sorted by final_score; failed requests get {"request_id": ..., "error": "..."}.
+# A row only needs its item_id: features it leaves out are gathered from the feature store by user and
+# item ID (scored as missing for unknown IDs), context, user recency and windowed item features are
+# derived from the request time, and counters come from the live state store.
+# With the score cache on, a row with the same user_id, item_id and supplied feature values scored under
+# the current feature and bundle versions in the same CACHE_BUCKET_SECONDS of request time is answered
+# from the cache (the time-derived features barely move within a bucket, and the hour never changes).
+LINE_LIMIT = 1 << 24  # Longest request/response line accepted on a connection
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent scoring requests into micro-batches. A batch is closed before the next
+    request would take it past max_batch rows, or max_wait_ms after its first request, then scored
+    with one engine.score_matrix() call on a worker thread (the event loop keeps accepting requests
+    meanwhile), and every caller gets its own rows back. Thousands of tiny predict calls per second
+    become a few large ones.
+    With a ScoreCache, only the rows without a fresh cached score go into a batch.
+    """
+
+    def __init__(self, engine, max_batch=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS, cache=None):
+        self.engine = engine
+        self.cache = cache
+        self.features = engine.features
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.workers = []
+        self.n_batches = 0
+        self.n_rows = 0
+        self.held = None  # Request that did not fit the last batch; it opens the next one
+
+    def start(self):
+        self.workers = [asyncio.create_task(self._run())]
+        return self
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    async def _refresh(self):
+        # Picks up feature store snapshots published by the feature step. Called between batches only,
+        # so a scoring pass never sees the engine's feature state half-swapped
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.engine.refresh_features)
+        except Exception as e:
+            print(f"    Feature store refresh failed ({type(e).__name__}: {e}); retrying in {REFRESH_SECONDS}s.")
+
+    async def score(self, user_id, rows):
+        """(len(rows), 3) array of SCORE_COLS for one user's candidate rows, in row order."""
+        if self.cache is None or not rows:
+            return (await self._batched(user_id, rows))[0]
+
+        cached = self.cache.get_many(self._cache_keys(user_id, rows, self.scoring_stamp(self.engine.request_time())))
+        scores = np.empty((len(rows), len(SCORE_COLS)), dtype=np.float32)
+        hits = [i for i, s in enumerate(cached) if s is not None]
+        if hits:
+            scores[hits] = [cached[i] for i in hits]
+        misses = [i for i, s in enumerate(cached) if s is None]
+        if misses:
+            miss_rows = [rows[i] for i in misses]
+            # Stored under the stamp the batch was actually scored with, not the one looked up
+            fresh, stamp = await self._batched(user_id, miss_rows)
+            self.cache.put_many(self._cache_keys(user_id, miss_rows, stamp), fresh.tolist())
+            scores[misses] = fresh
+        return scores
+
+    def scoring_stamp(self, now):
+        """Everything a score depends on besides its row: feature and bundle versions, request time bucket."""
+        return (self.engine.feature_version, self.engine.bundle.version,
+                now.value // (CACHE_BUCKET_SECONDS * 1_000_000_000))
+
+    @staticmethod
+    def _cache_keys(user_id, rows, stamp):
+        # Feature values a row supplies override the store's, so they are part of its key
+        return [(user_id, row['item_id']) + stamp + (tuple(sorted(row.items())),) for row in rows]
+
+    async def _batched(self, user_id, rows):
+        """(scores, scoring stamp) of one request's rows, scored in the next micro-batch."""
+        if not rows:
+            return np.empty((0, len(SCORE_COLS)), dtype=np.float32), None
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((user_id, rows, future))
+        return await future
+
+    async def _next_batch(self, idle_timeout=None):
+        """Next micro-batch of (user_id, rows, future); None if nothing arrives within idle_timeout."""
+        loop = asyncio.get_running_loop()
+        if self.held is not None:
+            batch, self.held = [self.held], None
+        else:
+            try:
+                batch = [await asyncio.wait_for(self.queue.get(), idle_timeout)]
+            except asyncio.TimeoutError:
+                return None
+        n_rows = len(batch[0][1])
+        deadline = loop.time() + self.max_wait
+        while n_rows < self.max_batch:
+            if self.queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self.queue.get_nowait()
+            if n_rows + len(item[1]) > self.max_batch:
+                # Never grow past max_batch rows (a single larger request still gets a batch of its own)
+                self.held = item
+                break
+            batch.append(item)
+            n_rows += len(item[1])
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time() + REFRESH_SECONDS
+        while True:
+            batch = await self._next_batch(max(next_refresh - loop.time(), 0))
+            if batch is not None:
+                await self._score_batch(batch)
+            if loop.time() >= next_refresh:
+                await self._refresh()
+                next_refresh = loop.time() + REFRESH_SECONDS
+
+    async def _score_batch(self, batch):
+        try:
+            user_ids = np.concatenate([np.full(len(rows), user_id) for user_id, rows, _ in batch])
+            rows = [row for _, request_rows, _ in batch for row in request_rows]
+            scores, stamp = await asyncio.get_running_loop().run_in_executor(None, self.score_rows, user_ids, rows)
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][2].done():
+                    batch[0][2].set_exception(e)
+                return
+            # One bad request must not fail its neighbours: retry them one by one
+            for item in batch:
+                await self._score_batch([item])
+            return
+        self.n_batches += 1
+        self.n_rows += len(rows)
+
+        # Hand every caller its slice
+        offset = 0
+        for _, request_rows, future in batch:
+            if not future.done():
+                future.set_result((scores[offset:offset + len(request_rows)], stamp))
+            offset += len(request_rows)
+
+    def score_rows(self, user_ids, rows):
+        """
+        One scoring pass over the rows of a whole micro-batch: (n, 3) scores in row order, and the
+        scoring stamp (versions and request time) they were computed with.
+        """
+        now = self.engine.request_time()
+        stamp = self.scoring_stamp(now)
+        frame = pd.DataFrame(rows, columns=self.features + ['item_id'])
+        if frame['item_id'].isna().any():
+            raise ValueError("Every row needs an item_id.")
+        A = self.engine.feature_matrix(frame)
+
+        # Missing features from the feature store and the request time, counters from the live state store
+        self.engine.fill_features(A, user_ids, frame['item_id'].to_numpy(np.int64), now)
+
+        # The engine reuses its output buffer, so the batch takes a copy
+        return self.engine.score_matrix(A).T.copy(), stamp
+
+
+async def answer(batcher, line):
+    """Response object for one request line (errors are reported per request, never raised)."""
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get('request_id')
+        rows = request['rows']
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise TypeError("rows must be a list of objects.")
+        scores = await batcher.score(request['user_id'], rows)
+        order = np.argsort(-scores[:, 2], kind='stable')
+        items = [{'item_id': rows[i]['item_id'], **dict(zip(SCORE_COLS, scores[i].tolist()))} for i in order]
+        return {'request_id': request_id, 'user_id': request['user_id'], 'items': items}
+    except Exception as e:
+        # Whatever went wrong, the request gets its error line: a file run or a connection never stalls on it
+        return {'request_id': request_id, 'error': f"{type(e).__name__}: {e}"}
+
+
+async def handle_connection(batcher, reader, writer):
+    """JSON lines in, JSON lines out. Responses are written as they complete: match them by request_id."""
+    pending = set()
+
+    async def respond(line):
+        writer.write((json.dumps(await answer(batcher, line)) + '\n').encode())
+
+    while line := await reader.readline():
+        if line.strip():
+            task = asyncio.create_task(respond(line))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        await writer.drain()
+    await asyncio.gather(*pending)
+    writer.close()
+
+
+async def start_server(batcher, host=HOST, port=PORT):
+    server = await asyncio.start_server(lambda r, w: handle_connection(batcher, r, w), host, port, limit=LINE_LIMIT)
+    print(f" Serving on {host}:{server.sockets[0].getsockname()[1]} "
+          f"(micro-batches of up to {batcher.max_batch} rows / {batcher.max_wait * 1000:g} ms)")
+    return server
+
+
+def make_batcher(max_batch=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS, cache=False):
+    return MicroBatcher(RecommendationServingEngine(), max_batch, max_wait_ms, ScoreCache() if cache else None).start()
+
+
+def cache_report(batcher):
+    if batcher.cache is not None:
+        stats = batcher.cache.stats()
+        print(f"   Score cache: hit rate {stats['hit_rate']:.1%} ({stats['hits']:,} hits, {stats['misses']:,} misses), "
+              f"{stats['entries']:,} entries / {stats['bytes'] / 1024 ** 2:.1f} MB, "
+              f"{stats['evictions']:,} evicted, {stats['expirations']:,} expired")
+
+
+async def serve(host=HOST, port=PORT, max_batch=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS, cache=False):
+    batcher = make_batcher(max_batch, max_wait_ms, cache)
+    server = await start_server(batcher, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def score_file(batcher, input_path=REQUESTS_PATH, output_path=RESULTS_PATH, max_in_flight=MAX_IN_FLIGHT):
+    """
+    Batched-file mode: streams a requests file through the batcher and writes one response line per
+    request, in input order. At most max_in_flight requests are pending, so memory stays bounded.
+    """
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    pending = collections.deque()
+    n_requests = 0
+    with open(input_path) as fin, open(tmp_path, 'w') as fout:
+        for line in fin:
+            if not line.strip():
+                continue
+            pending.append(asyncio.create_task(answer(batcher, line)))
+            n_requests += 1
+            if len(pending) >= max_in_flight:
+                fout.write(json.dumps(await pending.popleft()) + '\n')
+        while pending:
+            fout.write(json.dumps(await pending.popleft()) + '\n')
+    os.replace(tmp_path, output_path)
+    return n_requests
+
+
+def sample_requests(n_requests, rows_per_request=ROWS_PER_REQUEST, path=FEATURE_DATA_PATH, seed=0, zipf=0):
+    """
+    Stand-in traffic: requests of `rows_per_request` feature rows sampled from the training set.
+    With zipf > 0, requests repeat with Zipf(zipf) popularity over the distinct ones, as real traffic does.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f" Feature data not found at {path}. Run pipeline first.")
+    df = enforce_schema(pd.read_parquet(path), FEATURE_SCHEMA)
+    df = df.sample(n_requests * rows_per_request, replace=len(df) < n_requests * rows_per_request, random_state=seed)
+    records = df[['item_id'] + feature_columns(df)].to_dict('records')
+    user_ids = df['user_id'].to_numpy()
+    picks = np.arange(n_requests)
+    if zipf > 0:
+        ranks = np.arange(1, n_requests + 1)
+        weights = ranks ** -float(zipf)
+        picks = np.random.default_rng(seed).choice(n_requests, n_requests, p=weights / weights.sum())
+    return [{'request_id': i, 'user_id': int(user_ids[j * rows_per_request]),
+             'rows': records[j * rows_per_request:(j + 1) * rows_per_request]} for i, j in enumerate(picks)]
+
+
+async def client(host, port, requests, latencies):
+    """Stand-in client: sends its requests one at a time over one connection, recording latencies."""
+    reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+    for request in requests:
+        start = time.perf_counter()
+        writer.write((json.dumps(request) + '\n').encode())
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if 'error' in response:
+            raise RuntimeError(f"Request {response['request_id']} failed: {response['error']}")
+    writer.close()
+    await writer.wait_closed()
+
+
+async def benchmark(n_requests, n_clients, max_batch=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS, cache=False,
+                    zipf=ZIPF_EXPONENT):
+    """Serves on a free local port and drives it with n_clients concurrent stand-in clients."""
+    requests = sample_requests(n_requests, zipf=zipf)
+    batcher = make_batcher(max_batch, max_wait_ms, cache)
+    server = await start_server(batcher, HOST, 0)
+    port = server.sockets[0].getsockname()[1]
+
+    latencies = []
+    start = time.perf_counter()
+    async with server:
+        await asyncio.gather(*[client(HOST, port, requests[i::n_clients], latencies) for i in range(n_clients)])
+    elapsed = time.perf_counter() - start
+    await batcher.stop()
+
+    ms = np.percentile(latencies, [50, 99]) * 1000
+    print(f" {n_requests:,} requests from {n_clients} clients in {elapsed:.2f}s ({n_requests / elapsed:,.0f} req/s)")
+    print(f"   Latency p50 {ms[0]:.1f} ms, p99 {ms[1]:.1f} ms; "
+          f"{batcher.n_batches:,} batches of {batcher.n_rows / max(batcher.n_batches, 1):.0f} rows on average")
+    cache_report(batcher)
+
+
+async def run_file(input_path, output_path, max_batch=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS, cache=False):
+    batcher = make_batcher(max_batch, max_wait_ms, cache)
+    start = time.perf_counter()
+    n_requests = await score_file(batcher, input_path, output_path)
+    await batcher.stop()
+    print(f" Scored {n_requests:,} requests in {time.perf_counter() - start:.2f}s "
+          f"({batcher.n_batches:,} batches) -> {output_path}")
+    cache_report(batcher)
+
+
+def write_requests(n_requests, path=REQUESTS_PATH, zipf=ZIPF_EXPONENT):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        for request in sample_requests(n_requests, zipf=zipf):
+            f.write(json.dumps(request) + '\n')
+    print(f" Wrote {n_requests:,} sample requests to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['serve', 'file', 'bench', 'sample'],
+                        help="serve: JSON-lines TCP server; file: score a requests file; "
+                             "bench: local server + stand-in clients; sample: write a requests file")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--input', default=REQUESTS_PATH, help="Requests file (file/sample modes)")
+    parser.add_argument('--output', default=RESULTS_PATH, help="Results file (file mode)")
+    parser.add_argument('--requests', type=int, default=2000, help="Requests to send or write (bench/sample modes)")
+    parser.add_argument('--clients', type=int, default=64, help="Concurrent stand-in clients (bench mode)")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH_ROWS, help="Rows per micro-batch (1 = no batching)")
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS, help="Longest wait for a batch to fill")
+    parser.add_argument('--cache', action='store_true', help="Answer repeated (user, item) pairs from the score cache")
+    parser.add_argument('--zipf', type=float, default=ZIPF_EXPONENT,
+                        help="Popularity skew of sampled requests (bench/sample modes; 0 = all distinct)")
+    args = parser.parse_args()
+
+    if args.mode == 'serve':
+        asyncio.run(serve(args.host, args.port, args.max_batch, args.max_wait_ms, args.cache))
+    elif args.mode == 'file':
+        asyncio.run(run_file(args.input, args.output, args.max_batch, args.max_wait_ms, args.cache))
+    elif args.mode == 'bench':
+        asyncio.run(benchmark(args.requests, args.clients, args.max_batch, args.max_wait_ms, args.cache, args.zipf))
+    else:
+        write_requests(args.requests, args.input, args.zipf)